@@ -12,8 +12,15 @@
 """
 
 
+from fractions import gcd
+from itertools import product
+from multiprocessing import Pool, cpu_count
 from operator import itemgetter
 from pprint import pprint
+import argparse
+import csv
+import json
+import sys
 
 
 __author__ = 'taylanbil'
@@ -32,6 +39,360 @@ def step_one(half_num, num, carry):
     return half_num, num, carry
 
 
+DIRECTIONS = ('left', 'right')
+
+
+def check_direction(direction):
+    if direction not in DIRECTIONS:
+        raise ValueError("direction must be 'left' or 'right', not %r"
+                         % (direction,))
+
+
+def ceil_div(a, b):
+    return -(-a // b)
+
+
+def x_bounds(constraints):
+    """
+    The (lowest, highest) x, both inclusive and highest None if unbounded,
+    for which a * x >= b (strict False) or a * x < b (strict True) holds
+    for every (a, b, strict) in constraints; None if there is no such x.
+    """
+    lo, hi = 0, None
+    for a, b, strict in constraints:
+        if strict:
+            # a * x < b, that is a * x <= b - 1
+            a, b = -a, 1 - b
+        # a * x >= b
+        if a > 0:
+            lo = max(lo, ceil_div(b, a))
+        elif a < 0:
+            bound = b // a  # floor(b / a), as a < 0 flips the inequality
+            hi = bound if hi is None else min(hi, bound)
+        elif b > 0:
+            return None
+    if hi is not None and hi < lo:
+        return None
+    return lo, hi
+
+
+# residue_cycle of the (base, c, r, m) seen last, as the digits of one
+# ratio and base mostly share their modulus
+CYCLES = {}
+MAX_CYCLES = 256
+
+
+def residue_cycle(base, c, r, m):
+    """
+    (pre, period, hits) for the residues c * base ** j (mod m): they repeat
+    from j = pre on, every period (the multiplicative order of base modulo
+    the part of m prime to it), and hit r at the js in hits (< pre +
+    period). Takes one walk around the cycle, remembered in CYCLES.
+    """
+    key = base, c % m, r % m, m
+    if key in CYCLES:
+        return CYCLES[key]
+    seen = {}
+    hits = []
+    y, j = c % m, 0
+    while y not in seen:
+        seen[y] = j
+        if y == r % m:
+            hits.append(j)
+        y, j = y * base % m, j + 1
+    if len(CYCLES) >= MAX_CYCLES:
+        CYCLES.clear()
+    ans = CYCLES[key] = seen[y], j - seen[y], hits
+    return ans
+
+
+def first_exponent(base, c, r, m, start):
+    """
+    The smallest j >= start with c * base ** j = r (mod m), or None.
+    """
+    if m == 1:
+        return start
+    pre, period, hits = residue_cycle(base, c, r, m)
+    best = None
+    for h in hits:
+        if h < start:
+            if h < pre:
+                continue
+            h += ceil_div(start - h, period) * period
+        if best is None or h < best:
+            best = h
+    return best
+
+
+def rotation_exponent(digit, p, q, base=10, direction='left'):
+    """
+    k - 1 for the smallest number of k >= 2 digits (in base) ending in
+    digit for a right rotation, or starting with it for a left one, that
+    rotated one place that way gives p / q times itself, or None. This is
+    all there is to work out, rotation_number builds the number from it.
+
+    With k digits and x = base ** (k - 1), a left rotation of
+    N = digit * x + M gives M * base + digit, which is p / q times N when
+        M = digit * (p * x - q) / (q * base - p);
+    a right rotation of N = M * base + digit gives digit * x + M, which is
+    p / q times N when
+        M = digit * (q * x - p) / (p * base - q).
+    M has to be a whole number, which only depends on x modulo the
+    denominator (see first_exponent), and M, N and the rotated number
+    must have the right number of digits, which bounds x from both sides
+    (see x_bounds).
+    """
+    check_direction(direction)
+    if direction == 'left':
+        c, r = p, q
+        d = q * base - p
+        # M >= x / base (no leading 0 once rotated), and M < x
+        constraints = [(base * digit * p - d, base * digit * q, False),
+                       (digit * p - d, digit * q, True)]
+    else:
+        c, r = q, p
+        d = p * base - q
+        # M >= 0, N >= x (no leading 0), and N < base * x, M < x that is
+        constraints = [(q, p, False),
+                       (base * digit * q - d,
+                        base * digit * p - digit * d, False),
+                       (digit * q - d, digit * p, True)]
+    if d <= 0:
+        # the ratio is out of reach of a rotation
+        return None
+    bounds = x_bounds(constraints)
+    if bounds is None:
+        return None
+    lo, hi = bounds
+    start, x = 1, base
+    while x < lo:
+        start, x = start + 1, x * base
+    j = first_exponent(base, c, r, d // gcd(d, digit), start)
+    if j is None:
+        return None
+    if hi is not None:
+        # hi is small, so this is cheaper than base ** j for a long period
+        stop, x = 0, 1
+        while x * base <= hi:
+            stop, x = stop + 1, x * base
+        if j > stop:
+            return None
+    return j
+
+
+def rotation_number(j, digit, p, q, base=10, direction='left'):
+    """
+    The number of j + 1 digits that rotation_exponent found.
+    """
+    check_direction(direction)
+    x = base ** j
+    if direction == 'left':
+        return digit * x + digit * (p * x - q) // (q * base - p)
+    return digit * (q * x - p) // (p * base - q) * base + digit
+
+
+def smallest_with_digit(digit, p, q, base=10, direction='left'):
+    """
+    The smallest number of two or more digits (in base) ending in digit
+    for a right rotation, or starting with it for a left one, that
+    rotated one place that way gives p / q times itself, or None.
+    """
+    j = rotation_exponent(digit, p, q, base, direction)
+    return (None if j is None else
+            rotation_number(j, digit, p, q, base, direction))
+
+
+def smallest_rotation(p, q, base=10, direction='left'):
+    """
+    The smallest positive integer whose digits in base, rotated one place
+    left (the first digit moved to the end) or right, make p / q times the
+    integer; None if there is none.
+    """
+    check_direction(direction)
+    if p == q:
+        # rotating a single digit leaves it as it is
+        return 1
+    found = [smallest_with_digit(digit, p, q, base, direction)
+             for digit in xrange(1, base)]
+    found = [n for n in found if n is not None]
+    return min(found) if found else None
+
+
+def to_digits(n, base=10):
+    digits = []
+    while n:
+        n, digit = divmod(n, base)
+        digits.append(digit)
+    return digits[::-1]
+
+
+def rotate(n, base=10, direction='left'):
+    check_direction(direction)
+    digits = to_digits(n, base)
+    digits = (digits[1:] + digits[:1] if direction == 'left' else
+              digits[-1:] + digits[:-1])
+    ans = 0
+    for digit in digits:
+        ans = ans * base + digit
+    return ans
+
+
+SYMBOLS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def format_number(n, base=10):
+    """
+    n in base: with the symbols 0-9a-z up to base 36, digit values joined
+    by ':' past that.
+    """
+    if base == 10:
+        return str(n)
+    if base <= len(SYMBOLS):
+        return ''.join(SYMBOLS[digit] for digit in to_digits(n, base))
+    return ':'.join(str(digit) for digit in to_digits(n, base))
+
+
+FIELDS = ['p', 'q', 'base', 'direction', 'digit', 'digits', 'answer']
+
+
+def sweep_task(task):
+    """
+    One point of a sweep: the row of the smallest number for a ratio, base,
+    direction and rotated digit. digits is None if there is no such number,
+    and the answer is only written out (in base) up to max_digits digits;
+    past that the number is not even built.
+    """
+    p, q, base, direction, digit, max_digits = task
+    j = rotation_exponent(digit, p, q, base, direction)
+    row = dict(p=p, q=q, base=base, direction=direction, digit=digit,
+               digits=None, answer=None)
+    if j is not None:
+        row['digits'] = j + 1
+        if j + 1 <= max_digits:
+            row['answer'] = format_number(
+                rotation_number(j, digit, p, q, base, direction), base)
+    return row
+
+
+def sweep_tasks(ps, qs, bases, directions=('left', 'right'), digits=None,
+                max_digits=1000):
+    """
+    The sweep_task of each point of the grid, lazily. Ratios not in lowest
+    terms are left out, they repeat others; digits defaults to all of each
+    base.
+    """
+    for p, q, base, direction in product(ps, qs, bases, directions):
+        if gcd(p, q) != 1:
+            continue
+        for digit in (xrange(1, base) if digits is None else
+                      [digit for digit in digits if digit < base]):
+            yield p, q, base, direction, digit, max_digits
+
+
+def sweep(tasks, out, fmt='csv', workers=None, chunksize=64):
+    """
+    Run sweep_tasks on a pool of processes, writing each row to out (as CSV
+    or JSON lines) as soon as it is done, so in no particular order.
+    Returns the number of rows.
+    """
+    workers = workers or cpu_count()
+    pool = Pool(workers) if workers > 1 else None
+    rows = (pool.imap_unordered(sweep_task, tasks, chunksize)
+            if pool is not None else (sweep_task(task) for task in tasks))
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, FIELDS)
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        def write(row):
+            out.write(json.dumps(row, sort_keys=True) + '\n')
+    count = 0
+    try:
+        for row in rows:
+            write(row)
+            out.flush()
+            count += 1
+        return count
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def parse_range(text):
+    """
+    '2-16', '2,3,10' or a mix of both ('1-3,7') as a list of ints.
+    """
+    ans = []
+    for part in text.split(','):
+        if '-' in part:
+            start, stop = part.split('-')
+            ans.extend(xrange(int(start), int(stop) + 1))
+        else:
+            ans.append(int(part))
+    return ans
+
+
+def sweep_main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='rotate_smallest.py sweep',
+        description='Smallest rotation numbers over a grid of ratios p / q, '
+                    'bases, rotated digits and directions.')
+    parser.add_argument('-p', type=parse_range, default=parse_range('1-9'),
+                        help='numerators, like 1-9 or 2,3,5 (default 1-9)')
+    parser.add_argument('-q', type=parse_range, default=parse_range('1-9'),
+                        help='denominators (default 1-9)')
+    parser.add_argument('-b', '--bases', type=parse_range, default=[10],
+                        help='bases (default 10)')
+    parser.add_argument('-d', '--digits', type=parse_range, default=None,
+                        help='rotated digits (default all of each base)')
+    parser.add_argument('--directions', nargs='+', choices=DIRECTIONS,
+                        default=list(DIRECTIONS))
+    parser.add_argument('--max-digits', type=int, default=1000,
+                        help='leave out answers longer than this')
+    parser.add_argument('-o', '--out', default=None,
+                        help='file to write (default: stdout)')
+    parser.add_argument('-f', '--format', choices=['csv', 'jsonl'],
+                        default=None,
+                        help='default: jsonl for a .jsonl --out, else csv')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of processes (default: one per CPU)')
+    parser.add_argument('-c', '--chunksize', type=int, default=64)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ('jsonl' if args.out and
+                          args.out.endswith('.jsonl') else 'csv')
+    tasks = sweep_tasks(args.p, args.q, args.bases, args.directions,
+                        args.digits, args.max_digits)
+    out = open(args.out, 'wb') if args.out else sys.stdout
+    try:
+        count = sweep(tasks, out, fmt, args.workers, args.chunksize)
+    finally:
+        if args.out:
+            out.close()
+    sys.stderr.write('%s rows\n' % count)
+    return 0
+
+
+def rotation_main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='rotate_smallest.py',
+        description='The smallest number that rotated one place gives p / q '
+                    'times itself (try also: rotate_smallest.py sweep -h).')
+    parser.add_argument('p', type=int)
+    parser.add_argument('q', type=int)
+    parser.add_argument('base', type=int, nargs='?', default=10)
+    parser.add_argument('direction', nargs='?', choices=DIRECTIONS,
+                        default='left')
+    args = parser.parse_args(argv)
+    print(smallest_rotation(args.p, args.q, args.base, args.direction))
+    return 0
+
+
+# The original digit by digit search. It finds numbers that halve when
+# rotated left, not the 3 / 2 of the puzzle. For leading digits from 2 up,
+# smallest_with_digit(leading_digit, 1, 2, direction='left') gives the same
+# answers; for 1 it gives None, as the rotation of 105263157894736842 would
+# start with a 0.
 def main(leading_digit):
     half_num = [leading_digit]
     num = []
@@ -56,14 +417,23 @@ def main(leading_digit):
             occured_pairs.add(pair)
 
 
-if __name__ == '__main__':
+if __name__ == '__main__' and sys.argv[1:2] == ['sweep']:
+    sys.exit(sweep_main(sys.argv[2:]))
+elif __name__ == '__main__' and len(sys.argv) > 1:
+    sys.exit(rotation_main(sys.argv[1:]))
+elif __name__ == '__main__':
+    # The puzzle: rotated left, one and a half times the original.
+    ans = smallest_rotation(3, 2)
+    print('%s * 3 / 2 = %s' % (ans, rotate(ans)))
+    # 1176470588235294 * 3 / 2 = 1764705882352941
+    print('\n')
+
     ans = []
     for i in xrange(1, 10):
         ans.append((i, main(i)))
     pprint(ans)
     print('\n')
     pprint(min(ans, key=itemgetter(1))[1])
-
     # The answer is below:
     # The smallest number is the first one.
     #
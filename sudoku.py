@@ -4,8 +4,18 @@ Sudoku solver... with explanations and everything...
 """
 
 
-from itertools import combinations, product
+from array import array
+from collections import MutableSet, OrderedDict, deque, namedtuple
+from itertools import combinations, groupby, islice, permutations, product
+from multiprocessing import Event, Pool, Process, Queue, Value, cpu_count
 from operator import itemgetter
+from Queue import Empty
+from timeit import default_timer
+import argparse
+import random
+import shelve
+import sys
+import time
 import numpy as np
 
 
@@ -31,9 +41,282 @@ for key in MEANINGFUL_SUBGROUPS.keys():
     MEANINGFUL_SUBGROUPS[key].update(tmp)
 
 
+# Values (and positions) past 9 are written as letters: 1-9 and A-G on a
+# 16x16 board, 1-9 and A-P on a 25x25 one.
+SYMBOLS = '123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def values_to_mask(vals):
+    mask = 0
+    for v in vals:
+        mask |= 1 << (v - 1)
+    return mask
+
+
+class MaskTable(dict):
+    """
+    mask -> function(mask), worked out the first time a mask comes up.
+    Stands in for the precomputed lists on boards too big to enumerate
+    every mask of. Past maxsize masks it starts over, so that long lived
+    processes do not collect every mask they ever saw.
+    """
+
+    def __init__(self, function, maxsize=1 << 16):
+        dict.__init__(self)
+        self.function = function
+        self.maxsize = maxsize
+
+    def __missing__(self, mask):
+        if len(self) >= self.maxsize:
+            self.clear()
+        ans = self[mask] = self.function(mask)
+        return ans
+
+
+# The number of bits set in every 16 bit mask, see MaskCount.
+COUNTS_16 = []
+
+
+def counts_16():
+    if not COUNTS_16:
+        COUNTS_16.extend(bin(mask).count('1') for mask in xrange(1 << 16))
+    return COUNTS_16
+
+
+class MaskCount(object):
+    """
+    mask -> the number of bits set in it, for masks of up to 32 bits (the
+    25x25 boards, the largest SYMBOLS go to), as the sum of the counts of
+    its 16 bit halves.
+    """
+
+    def __init__(self):
+        self.counts = counts_16()
+
+    def __getitem__(self, mask):
+        return self.counts[mask & 0xffff] + self.counts[mask >> 16]
+
+
+# What SudokuBatch multiplies candidates with, see SudokuShape.matrices.
+BatchMatrices = namedtuple('BatchMatrices',
+                           'peer unit segment line_rest square_rest '
+                           'segment_lines segment_squares')
+
+
+class SudokuShape(object):
+    """
+    Everything that depends on the size of the board, worked out once per
+    size (see get_shape). A board of size n has n rows, columns and squares
+    of n cells each, values 1 to n and squares box = sqrt(n) cells wide.
+    """
+
+    def __init__(self, box):
+        size = box * box
+        self.box = box
+        self.size = size
+        self.n_cells = size * size
+
+        # Candidates are kept as size-bit integers: bit (v - 1) is set iff v
+        # is still possible for the cell.
+        def values(mask):
+            return tuple(v for v in xrange(1, size + 1) if mask >> (v - 1) & 1)
+        self.full_mask = (1 << size) - 1
+        if size <= 9:
+            self.mask_values = [values(mask)
+                                for mask in xrange(self.full_mask + 1)]
+            self.mask_count = [len(vals) for vals in self.mask_values]
+        else:
+            self.mask_values = MaskTable(values)
+            # a 16x16 board's masks index the counts directly
+            self.mask_count = counts_16() if size <= 16 else MaskCount()
+        # The subset sizes fit/spot look for by default. Triples pay for
+        # themselves on 9x9 boards, not on larger ones; quads (n = 4 works
+        # too) have not so far.
+        self.subset_sizes = (1, 2, 3) if size <= 9 else (1, 2)
+        # Likewise the extra techniques (CHAINS): they save guesses on 9x9
+        # boards, but cost more than those on larger ones.
+        self.extra_techniques = (('xy_wing', 'x_wing', 'swordfish',
+                                  'coloring') if size <= 9 else ())
+        self.combinations = {}
+        self._matrices = None
+
+        # Cell indices (row * size + column) of every group, in the order
+        # of SudokuTable.groups: rows, columns, then squares.
+        cells = xrange(self.n_cells)
+        self.units = units = (
+            [[size * r + c for c in xrange(size)] for r in xrange(size)] +
+            [[size * r + c for r in xrange(size)] for c in xrange(size)] +
+            [[size * (box * (sq // box) + i) + box * (sq % box) + j
+              for i in xrange(box) for j in xrange(box)]
+             for sq in xrange(size)])
+        self.cell_units = [[] for cell in cells]
+        for u, unit in enumerate(units):
+            for cell in unit:
+                self.cell_units[cell].append(u)
+        self.peer_sets = [set(c for u in self.cell_units[cell]
+                              for c in units[u]) - set([cell])
+                          for cell in cells]
+        self.peers = [sorted(peers) for peers in self.peer_sets]
+        self.group_offsets = {'row': 0, 'column': size, 'square': 2 * size}
+
+        # related_groups[g] maps the places of a value in group g, as a mask
+        # with bit i - 1 for the cell at position i, to the other group
+        # holding all of them. Only two or more places count; a lone place
+        # is a single and fit/spot deal with it.
+        # group_difference[g][h] lists the cells of group h that are not in
+        # g. meaningful_subgroups has the related places of each group kind
+        # as strings of positions, like MEANINGFUL_SUBGROUPS.
+        self.related_groups = []
+        self.group_difference = []
+        self.meaningful_subgroups = dict(
+            (kind, set()) for kind in self.group_offsets)
+        for g, unit in enumerate(units):
+            kind = self.group_kind(g)
+            members = set(unit)
+            self.related_groups.append({})
+            self.group_difference.append([])
+            for h, other in enumerate(units):
+                shared = [pos for pos, cell in enumerate(unit)
+                          if cell in other]
+                self.group_difference[-1].append(
+                    [cell for cell in other if cell not in members])
+                if len(shared) == len(unit):
+                    continue
+                for n in xrange(2, len(shared) + 1):
+                    for positions in combinations(shared, n):
+                        mask = sum(1 << pos for pos in positions)
+                        self.related_groups[-1][mask] = h
+                        self.meaningful_subgroups[kind].add(
+                            ''.join(SYMBOLS[pos] for pos in positions))
+
+    def group_kind(self, g):
+        return ('row', 'column', 'square')[g // self.size]
+
+    def combination_masks(self, n):
+        """
+        (values, mask) for every n-subset of the values.
+        """
+        ans = self.combinations.get(n)
+        if ans is None:
+            ans = self.combinations[n] = [
+                (nuple, values_to_mask(nuple))
+                for nuple in combinations(xrange(1, self.size + 1), n)]
+        return ans
+
+    def matrices(self):
+        """
+        The incidence matrices SudokuBatch works with, built on first use.
+        segment are the cells where a square crosses a row or a column, and
+        line_rest and square_rest the rest of that line and square.
+        """
+        if self._matrices is None:
+            units, n_lines = self.units, 2 * self.size
+            segments, segment_lines, segment_squares = [], [], []
+            for sq in xrange(n_lines, len(units)):
+                for line in xrange(n_lines):
+                    segment = set(units[sq]).intersection(units[line])
+                    if segment:
+                        segments.append(sorted(segment))
+                        segment_lines.append(line)
+                        segment_squares.append(sq)
+            self._matrices = BatchMatrices(
+                incidence_matrix(self.peers, self.n_cells),
+                incidence_matrix(units, self.n_cells),
+                incidence_matrix(segments, self.n_cells),
+                incidence_matrix(
+                    [sorted(set(units[line]).difference(segment))
+                     for line, segment in zip(segment_lines, segments)],
+                    self.n_cells).T,
+                incidence_matrix(
+                    [sorted(set(units[sq]).difference(segment))
+                     for sq, segment in zip(segment_squares, segments)],
+                    self.n_cells).T,
+                segment_lines, segment_squares)
+        return self._matrices
+
+
+SHAPES = {}
+
+
+def get_shape(size):
+    """
+    The SudokuShape of a size by size board, size being a square.
+    """
+    shape = SHAPES.get(size)
+    if shape is None:
+        box = int(round(size ** 0.5))
+        if box < 2 or box * box != size:
+            raise ValueError('Board size must be a square, got %s' % size)
+        shape = SHAPES[size] = SudokuShape(box)
+    return shape
+
+
+# The 9x9 tables, under the names they always had.
+SHAPE_9 = get_shape(9)
+FULL_MASK = SHAPE_9.full_mask
+MASK_VALUES = SHAPE_9.mask_values
+MASK_COUNT = SHAPE_9.mask_count
+COMBINATION_MASKS = [SHAPE_9.combination_masks(n) for n in xrange(10)]
+UNITS = SHAPE_9.units
+CELL_UNITS = SHAPE_9.cell_units
+PEERS = SHAPE_9.peers
+GROUP_OFFSETS = SHAPE_9.group_offsets
+RELATED_GROUPS = SHAPE_9.related_groups
+GROUP_DIFFERENCE = SHAPE_9.group_difference
+
+
+# What the solver did and why, as handed to a sink (any callable taking one
+# Explanation). group and related are (group_kind, number) pairs, values a
+# tuple of values and cells the (row, column) pairs of the cells involved;
+# numbers are 1-based like in the printed explanations. Fish have tuples of
+# numbers for the rows and columns, and an XY-wing the cells of the wing as
+# related. Nothing is built unless a sink is attached.
+Explanation = namedtuple('Explanation',
+                         'technique group values cells related')
+
+
+class CandidateSet(MutableSet):
+    """
+    The candidates of a cell as a set, reading and writing its mask.
+    Removing values eliminates them like eliminate_possibilities does,
+    adding them puts them back like set_possible_vals, which only a cell
+    outside a SudokuTable allows.
+    """
+
+    def __init__(self, cell):
+        self.cell = cell
+
+    def __contains__(self, val):
+        return (isinstance(val, (int, long)) and 0 < val <= self.cell.size and
+                self.cell.check_possibility(val))
+
+    def __iter__(self):
+        return iter(get_shape(self.cell.size).mask_values[self.cell.mask])
+
+    def __len__(self):
+        return get_shape(self.cell.size).mask_count[self.cell.mask]
+
+    def __repr__(self):
+        return 'CandidateSet(%r)' % (set(self),)
+
+    def add(self, val):
+        if val not in self:
+            self.cell.set_possible_vals(list(self) + [val])
+
+    def discard(self, val):
+        if val in self:
+            self.cell.eliminate_possibilities(val)
+
+
 class SudokuCell(object):
 
-    def __init__(self, val=None):
+    __slots__ = ('val', 'mask', 'is_set', 'groups', 'trail', 'size')
+
+    def __init__(self, val=None, size=9):
+        # both filled in by SudokuTable.groupify
+        self.groups = ()
+        self.trail = None
+        self.size = size  # of the board
         self.set_value(val)
         self.set_possible_vals(val)
         # self.is_set = False if val is None else True
@@ -47,55 +330,204 @@ class SudokuCell(object):
 
     def set_possible_vals(self, possible_vals):
         if possible_vals is None:
-            self.possible_vals = set(range(1, 10))
+            mask = (1 << self.size) - 1
         elif isinstance(possible_vals, int):
-            self.possible_vals = set([possible_vals])
+            mask = 1 << (possible_vals - 1)
+        else:
+            mask = values_to_mask(possible_vals)
+        if not self.groups:
+            self.mask = mask
+        elif mask & ~self.mask:
+            # what the groups deduced from the old candidates would not hold
+            raise ValueError('Cannot add candidates back to a cell of a '
+                             'SudokuTable, undo to a mark instead')
         else:
-            self.possible_vals = set(possible_vals)
-        # if len(self.possible_vals) == 1:
-        #     self.is_set = True
+            self.restrict_mask(mask)
+
+    @property
+    def possible_vals(self):
+        """
+        Set view of the candidates, for callers that want one: changing it
+        in place (discard, add, -= ...) changes the cell. Hot paths should
+        use self.mask instead.
+        """
+        return CandidateSet(self)
+
+    @possible_vals.setter
+    def possible_vals(self, possible_vals):
+        self.set_possible_vals(possible_vals)
 
     def eliminate_possibilities(self, val):
         if isinstance(val, int):
-            val = [val]
-        self.possible_vals.difference_update(set(val))
-        # if len(self.possible_vals) == 1:
-        #     self.is_set = True
+            self.eliminate_mask(1 << (val - 1))
+        else:
+            self.eliminate_mask(values_to_mask(val))
+
+    def eliminate_mask(self, bits):
+        old = self.mask
+        if old & bits:
+            if self.trail is not None:
+                self.trail.append((self, old))
+            self.mask = mask = old & ~bits
+            for group in self.groups:
+                group.update_counts(old, mask)
+                group.mark_dirty()
+
+    def restrict_mask(self, bits):
+        self.eliminate_mask(self.mask & ~bits)
+
+    def restore(self, mask):
+        old, self.mask = self.mask, mask
+        for group in self.groups:
+            group.update_counts(old, mask)
 
     def check_possibility(self, val):
-        return val in self.possible_vals
+        return bool(self.mask >> (val - 1) & 1)
+
+    @property
+    def position(self):
+        """
+        (row, column), 1-based, once the cell is part of a SudokuTable.
+        """
+        return self.groups[0].id_num + 1, self.groups[1].id_num + 1
 
 
 class SudokuGroup(object):
 
     def __init__(self, cells, group_kind, id_num):
-        assert len(cells) == 9
-        self.cells = zip(range(1, 10), cells)  # [(1, c1), (2, c2), ...]
-        self.settled_combinations = set([])
+        self.shape = shape = get_shape(len(cells))
+        # [(1, c1), (2, c2), ...]
+        self.cells = zip(range(1, shape.size + 1), cells)
+        self.settled_masks = []
         self.spotted_vals = set([])
-        self.places = set(xrange(1, 10))
-        self.meaningful_subgroups = MEANINGFUL_SUBGROUPS[group_kind]
+        self.places = set(xrange(1, shape.size + 1))
+        self.meaningful_subgroups = shape.meaningful_subgroups[group_kind]
         self.group_kind = group_kind
         self.id_num = id_num
+        self.index = shape.group_offsets[group_kind] + id_num  # in units
+        # Work queue, undo trail and explanation sink of the owning
+        # SudokuTable, see mark_dirty, SudokuTable.undo and
+        # SudokuTable.set_sink.
+        self.queue = None
+        self.trail = None
+        self.sink = None
+        self.dirty = False
+        # {(technique, n): state} of the last fit/spot scans that found
+        # nothing; the same state would not give anything either.
+        self.scanned = {}
+        # The owning SudokuTable's list of groups with contradictions, and
+        # its {(technique, n): times fired} counts.
+        self.conflicts = None
+        self.applied = None
+        self.count()
+
+    def mark_dirty(self):
+        """
+        One of our cells lost a candidate, so fit/spot may find something
+        new here. Queue the group for the table's next propagation round.
+        """
+        if not self.dirty:
+            self.dirty = True
+            if self.queue is not None:
+                self.queue.append(self)
+
+    def restore(self, n_settled):
+        del self.settled_masks[n_settled:]
+
+    def count(self):
+        """
+        Count from scratch what update_counts keeps up to date: the places
+        left for every value, the cells settled to every value and in all,
+        and the contradictions among those (values without a place, values
+        settled twice and cells without a candidate).
+        """
+        size = self.shape.size
+        self.value_counts = [0] * (size + 1)
+        self.single_counts = [0] * (size + 1)
+        for i, cell in self.cells:
+            vals = self.shape.mask_values[cell.mask]
+            for val in vals:
+                self.value_counts[val] += 1
+            if len(vals) == 1:
+                self.single_counts[vals[0]] += 1
+        self.n_singles = sum(self.single_counts)
+        self.n_conflicts = (
+            self.value_counts[1:].count(0) +
+            sum([n - 1 for n in self.single_counts if n > 1]) +
+            len([cell for i, cell in self.cells if not cell.mask]))
+
+    def update_counts(self, old, new):
+        """
+        One of our cells went from candidates old to new: fewer of them on
+        elimination, more on undo. Adjust the counts, and report the group
+        to the table as soon as a contradiction comes up.
+        """
+        mask_values = self.shape.mask_values
+        mask_count = self.shape.mask_count
+        value_counts = self.value_counts
+        single_counts = self.single_counts
+        conflicts = 0
+        for val in mask_values[old & ~new]:
+            value_counts[val] -= 1
+            if not value_counts[val]:
+                conflicts += 1
+        for val in mask_values[new & ~old]:
+            if not value_counts[val]:
+                conflicts -= 1
+            value_counts[val] += 1
+        n_old = mask_count[old]
+        if n_old == 1:
+            val = mask_values[old][0]
+            single_counts[val] -= 1
+            if single_counts[val]:
+                conflicts -= 1
+            self.n_singles -= 1
+        elif not n_old:
+            conflicts -= 1
+        n_new = mask_count[new]
+        if n_new == 1:
+            val = mask_values[new][0]
+            if single_counts[val]:
+                conflicts += 1
+            single_counts[val] += 1
+            self.n_singles += 1
+        elif not n_new:
+            conflicts += 1
+        if conflicts:
+            if not self.n_conflicts and self.conflicts is not None:
+                self.conflicts.append(self)
+            self.n_conflicts += conflicts
+
+    @property
+    def settled_combinations(self):
+        return set(frozenset(self.shape.mask_values[mask])
+                   for mask in self.settled_masks)
 
     def every_cell_has_val(self):
-        return all([len(cell.possible_vals)
-                    for cell in map(itemgetter(1), self.cells)])
+        for i, cell in self.cells:
+            if not cell.mask:
+                return False
+        return True
 
     def every_val_has_cell(self):
-        return all([self.val_has_cell(val) for val in self.places])
+        union = 0
+        for i, cell in self.cells:
+            union |= cell.mask
+        return union == self.shape.full_mask
 
     def val_has_cell(self, val):
+        bit = 1 << (val - 1)
         for i, cell in self.cells:
-            if val in cell.possible_vals:
+            if cell.mask & bit:
                 return True
         else:
             return False
 
     def same_value_set(self, val):
+        bit = 1 << (val - 1)
         value_set = False
         for i, cell in self.cells:
-            if val in cell.possible_vals and len(cell.possible_vals) == 1:
+            if cell.mask == bit:
                 if value_set:
                     return True
                 else:
@@ -104,264 +536,1048 @@ class SudokuGroup(object):
             return False
 
     def duplicate_values_set(self):
-        for val in self.places:
-            if self.same_value_set(val):
-                return True
+        mask_count = self.shape.mask_count
+        seen = 0
+        for i, cell in self.cells:
+            if mask_count[cell.mask] == 1:
+                if seen & cell.mask:
+                    return True
+                seen |= cell.mask
         else:
             return False
 
     def check_group_validity(self):
-        if self.every_cell_has_val() and self.every_val_has_cell() and \
-                not self.duplicate_values_set():
-            return True
-        else:
-            return False
+        """
+        Every cell has a candidate, every value a place, and no value is
+        settled twice. Kept up to date by update_counts, see count.
+        """
+        return not self.n_conflicts
 
     def settle_combination(self, nuple, fitted_cells, settle_type,
                            explain=True):
-        not_this_nuple = self.places.difference(nuple)
+        nuple_mask = values_to_mask(nuple)
         fitted_cell_list = map(itemgetter(1), fitted_cells)
+        explain = explain and self.sink is not None
+        if explain:
+            before = [cell.mask for i, cell in self.cells]
         for i, cell in self.cells:
             if cell in fitted_cell_list:
-                cell.eliminate_possibilities(not_this_nuple)
+                cell.restrict_mask(nuple_mask)
             else:
-                cell.eliminate_possibilities(nuple)
-        self.settled_combinations.add(nuple)
-        # Explanation
-        if explain and len(nuple) == 1:
+                cell.eliminate_mask(nuple_mask)
+        if self.trail is not None:
+            self.trail.append((self, len(self.settled_masks)))
+        self.settled_masks.append(nuple_mask)
+        if self.applied is not None:
+            key = settle_type, len(nuple)
+            self.applied[key] = self.applied.get(key, 0) + 1
+        if explain:
+            self.explain_settle(nuple, fitted_cell_list, settle_type, before)
+
+    def explain_settle(self, nuple, fitted_cell_list, settle_type, before):
+        group = (self.group_kind, self.id_num + 1)
+        values = tuple(sorted(nuple))
+        if len(nuple) == 1:
             cell = fitted_cell_list[0]
             if not cell.is_set:
                 cell.is_set = True
-                other_group_kinds = {'square', 'row', 'column'}.difference(
-                    set([self.group_kind]))
-                other_group_kinds = list(other_group_kinds)
-                args = (list(nuple)[0], self.group_kind, self.id_num + 1,
-                        other_group_kinds[0], other_group_kinds[1])
-                print(('There is only one cell that can contain the value %s in'
-                       ' %s #%s! Adjusting the appropriate %s and %s'
-                       ' accordingly.' % args))
-        elif explain and settle_type == 'fit':
-            print(('In %s #%s, there are %s cells with only possible values'
-                   ' %s, so the other cells in this %s cannot contain any of'
-                   ' %s' % (self.group_kind, self.id_num+1, len(nuple),
-                            list(nuple), self.group_kind, list(nuple))))
-        elif explain:
-            print(('In %s #%s, the values %s can only be in %s cells. So those'
-                   ' cells cannot contain any other value'
-                   % (self.group_kind, self.id_num+1, list(nuple), len(nuple))))
+                self.sink(Explanation('single', group, values,
+                                      (cell.position,), None))
+        else:
+            cells = tuple(cell.position for (i, cell), mask
+                          in zip(self.cells, before) if cell.mask != mask)
+            self.sink(Explanation(settle_type, group, values, cells, None))
 
     def could_relate(self, n):
-        container = ''.join(map(str, [i for i, cell in self.cells
-                                      if n in cell.possible_vals]))
-        if container in self.meaningful_subgroups:
+        bit = 1 << (n - 1)
+        places = 0
+        for i, cell in self.cells:
+            if cell.mask & bit:
+                places |= 1 << (i - 1)
+        if places in self.shape.related_groups[self.index]:
+            container = ''.join([SYMBOLS[i - 1] for i, cell in self.cells
+                                 if places >> (i - 1) & 1])
             return container, n
         return False, None
 
+    def value_places(self):
+        """
+        For every value, the mask of the positions that can still hold it
+        (bit i - 1 for position i). Index 0 is unused.
+        """
+        mask_values = self.shape.mask_values
+        places = [0] * (self.shape.size + 1)
+        for i, cell in self.cells:
+            bit = 1 << (i - 1)
+            for val in mask_values[cell.mask]:
+                places[val] |= bit
+        return places
+
     def fit_combination(self, nuple, explain=True):
+        self.fit_mask(nuple, values_to_mask(nuple), explain)
+
+    def fit_mask(self, nuple, mask, explain=True):
         fitted_cells = [(i, cell) for i, cell in self.cells
-                        if nuple.issuperset(cell.possible_vals)]
+                        if not cell.mask & ~mask]
         if len(fitted_cells) == len(nuple):
             # settled
-            self.settle_combination(nuple, fitted_cells, 'fit')
+            self.settle_combination(nuple, fitted_cells, 'fit', explain)
 
     def fit(self, n, explain=True):
         """
-        This should be called with n <= 4
+        Naked subsets: n cells with only n values between them settle those
+        values. Rather than going through every n values, only cells with
+        at most n candidates are combined, leaving out those holding a
+        whole settled combination already, so nearly solved groups cost
+        next to nothing. Returns how many combinations were tried.
         """
-        for nuple in combinations(xrange(1, 10), n):
-            if self.to_fit(nuple):
-                self.fit_combination(frozenset(nuple), explain=True)
+        mask_count = self.shape.mask_count
+        mask_values = self.shape.mask_values
+        masks = [cell.mask for i, cell in self.cells
+                 if 0 < mask_count[cell.mask] <= n and
+                 self.to_fit_mask(cell.mask)]
+        # singles cost less to look for than to remember
+        state = self.scan_state() if len(masks) > n > 1 else None
+        if state is not None and self.scanned.get(('fit', n)) == state:
+            return 0
+        n_settled = len(self.settled_masks)
+        tried = 0
+        for nuple in combinations(masks, n):
+            tried += 1
+            union = 0
+            for mask in nuple:
+                union |= mask
+            if mask_count[union] == n and self.to_fit_mask(union):
+                self.fit_mask(frozenset(mask_values[union]), union, explain)
+        if state is not None and len(self.settled_masks) == n_settled:
+            self.scanned['fit', n] = state
+        return tried
 
     def spot(self, n, explain=True):
-        for nuple in combinations(xrange(1, 10), n):
-            if self.to_fit(nuple):
-                self.spot_combination(frozenset(nuple), explain=True)
+        """
+        Hidden subsets: n values with only n places between them settle
+        those places. Only values with at most n places that are not
+        settled on their own are combined. Returns how many combinations
+        were tried.
+        """
+        value_counts = self.value_counts
+        vals = [val for val in xrange(1, self.shape.size + 1)
+                if 0 < value_counts[val] <= n and
+                self.to_fit_mask(1 << (val - 1))]
+        if len(vals) < n:
+            return 0
+        state = self.scan_state() if len(vals) > n > 1 else None
+        if state is not None and self.scanned.get(('spot', n)) == state:
+            return 0
+        mask_count = self.shape.mask_count
+        places = self.value_places()
+        n_settled = len(self.settled_masks)
+        tried = 0
+        for nuple in combinations(vals, n):
+            tried += 1
+            union = 0
+            for val in nuple:
+                union |= places[val]
+            if mask_count[union] != n:
+                continue
+            mask = values_to_mask(nuple)
+            if self.to_fit_mask(mask):
+                self.spot_mask(frozenset(nuple), mask, explain)
+        if state is not None and len(self.settled_masks) == n_settled:
+            self.scanned['spot', n] = state
+        return tried
+
+    def scan_state(self):
+        """
+        All fit and spot look at: the candidates and the settled masks.
+        """
+        return (tuple(self.settled_masks),
+                tuple([cell.mask for i, cell in self.cells]))
 
     def spot_combination(self, nuple, explain=True):
-        disjoint_cells = [(i, cell) for i, cell in self.cells
-                          if nuple.isdisjoint(cell.possible_vals)]
-        disjoint_indices = map(itemgetter(0), disjoint_cells)
+        self.spot_mask(nuple, values_to_mask(nuple), explain)
+
+    def spot_mask(self, nuple, mask, explain=True):
         overlapping_cells = [(i, cell) for i, cell in self.cells
-                             if i not in disjoint_indices]
-        if len(disjoint_cells) + len(nuple) == 9:
-            self.settle_combination(nuple, overlapping_cells, 'spot')
+                             if cell.mask & mask]
+        if len(overlapping_cells) == len(nuple):
+            self.settle_combination(nuple, overlapping_cells, 'spot',
+                                    explain)
 
     def to_fit(self, nuple):
-        return not any(settled_comb.issubset(nuple)
-                       for settled_comb in self.settled_combinations)
+        return self.to_fit_mask(values_to_mask(nuple))
+
+    def to_fit_mask(self, mask):
+        for settled in self.settled_masks:
+            if not settled & ~mask:
+                return False
+        return True
 
     def is_solved(self):
-        if self.check_group_validity():
-            return all([len(cell.possible_vals) == 1
-                        for cell in map(itemgetter(1), self.cells)])
-        else:
-            return False
+        return not self.n_conflicts and self.n_singles == self.shape.size
+
+
+class TechniqueStats(object):
+    """
+    What one technique, at one subset size, cost and earned in a solve.
+    tried counts the combinations (or, for relate, the group/value pairs)
+    looked at and fired those that matched: a settled subset, or a value
+    confined to another group.
+    """
+
+    __slots__ = ('calls', 'tried', 'fired', 'eliminated', 'seconds')
+
+    def __init__(self):
+        self.calls = self.tried = self.fired = self.eliminated = 0
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return ('TechniqueStats(calls=%s, tried=%s, fired=%s, eliminated=%s,'
+                ' seconds=%.6f)' % (self.calls, self.tried, self.fired,
+                                    self.eliminated, self.seconds))
+
+
+class SolveResult(object):
+    """
+    What SudokuTable.solve got to. status is 'solved', 'unsolvable', or
+    'deadline' or 'max_nodes' when the budget ran out first. grid has the
+    candidates left in every cell, as tuples of values; techniques how many
+    times each (technique, n) fired; nodes the guesses made and seconds
+    the time taken, by this call. True only when solved.
+    """
+
+    __slots__ = ('status', 'grid', 'techniques', 'nodes', 'seconds')
+
+    def __init__(self, status, grid, techniques, nodes, seconds):
+        self.status = status
+        self.grid = grid
+        self.techniques = techniques
+        self.nodes = nodes
+        self.seconds = seconds
+
+    def __nonzero__(self):
+        return self.status == 'solved'
+
+    def __repr__(self):
+        return ('SolveResult(status=%r, techniques=%r, nodes=%s, '
+                'seconds=%.6f)' % (self.status, self.techniques, self.nodes,
+                                   self.seconds))
+
+
+# How hard a puzzle is, easiest first: the techniques a SudokuTable needs
+# to solve it without guessing, as (subset sizes, relate_groups or not,
+# extra techniques). 'search' puzzles take trial and error on top of
+# everything else.
+DIFFICULTIES = ['singles', 'relate', 'pairs', 'triples', 'fish', 'chains',
+                'search']
+# cheapest first, as measured by sudoku_bench.py --stats
+FISH = ('x_wing', 'swordfish')
+CHAINS = ('xy_wing',) + FISH + ('coloring',)
+TECHNIQUES = {
+    'singles': ((1,), False, ()),
+    'relate': ((1,), True, ()),
+    'pairs': ((1, 2), True, ()),
+    'triples': ((1, 2, 3), True, ()),
+    'fish': ((1, 2, 3), True, FISH),
+    'chains': ((1, 2, 3), True, CHAINS),
+    'search': ((1, 2, 3), True, CHAINS),
+}
 
 
 class SudokuTable(object):
 
+    # The subset sizes fit/spot look for (None for the default of the board
+    # size) and whether relate_groups runs. Narrow them on a table to find
+    # out what a puzzle really needs, see use_techniques.
+    subset_sizes = None
+    relating = True
+    # Names of the methods deduce turns to, in this order, when fit/spot
+    # and relate_groups find nothing more (None for the default of the
+    # board size). Each takes explain and returns how many times it
+    # eliminated something.
+    extra_techniques = None
+    # A random.Random to make search try the values of a guess in random
+    # order, or None for increasing order.
+    rng = None
+
     def __init__(self, table):
         """
-        squares must be a 9 by 9 nested array
+        squares must be an n by n nested array of SudokuCells, n being 9, 16,
+        25 or any other square
         """
-        self.line = '-' * 73
         self.table = np.array(table)
-        assert self.table.shape == (9, 9)
+        size = len(self.table)
+        assert self.table.shape == (size, size)
+        self.shape = get_shape(size)
+        if self.subset_sizes is None:
+            self.subset_sizes = self.shape.subset_sizes
+        if self.extra_techniques is None:
+            self.extra_techniques = self.shape.extra_techniques
+        self.line = '-' * (self.shape.box * (size + 6) + 3 * size + 1)
         self.groupify()
         self.solved = False
+        self.sink = None
+        self.nodes = 0  # guesses made by search
+        # {(technique, n): TechniqueStats} once enable_stats is called
+        self.stats = None
+        # The budget of the current solve, a time.time() to stop at and a
+        # self.nodes not to go past, and which of them ran out.
+        self.deadline = None
+        self.node_limit = None
+        self.stopped = None
+        self.places = None  # see group_places
 
     def groupify(self):
         self.rows = []
         self.columns = []
         self.sq3 = []
+        size, box = self.shape.size, self.shape.box
         # rows
-        for row in xrange(9):
+        for row in xrange(size):
             group_row = SudokuGroup(self.table[row, :].ravel(), 'row', row)
             self.rows.append(group_row)
         # columns
-        for col in xrange(9):
+        for col in xrange(size):
             group_col = SudokuGroup(self.table[:, col].ravel(), 'column', col)
             self.columns.append(group_col)
-        # 3by3 squares
-        for i, j in product(range(3), range(3)):
+        # box by box squares
+        for i, j in product(range(box), range(box)):
             # order:
             # (0, 0), (0, 1), (0, 2), (1, 0), ..., (2, 1), (2, 2)
-            group_sq3 = SudokuGroup(self.table[3*i:3*i+3, 3*j:3*j+3].ravel(),
-                                    'square', i*3+j)
+            group_sq3 = SudokuGroup(
+                self.table[box*i:box*i+box, box*j:box*j+box].ravel(),
+                'square', i*box+j)
             self.sq3.append(group_sq3)
         self.groups = self.rows + self.columns + self.sq3
+        self.cells = [cell for row in self.table for cell in row]
+        # Groups whose cells changed since fit/spot last looked at them.
+        self.queue = deque()
+        # (cell, old mask) and (group, old len(settled_masks)) entries,
+        # replayed backwards by undo.
+        self.trail = []
+        # Groups that ran into a contradiction, see update_counts.
+        self.conflicts = [group for group in self.groups
+                          if group.n_conflicts]
+        # {(technique, n): times fired}, relate counting with n None.
+        self.applied = {}
+        for group in self.groups:
+            group.queue = self.queue
+            group.trail = self.trail
+            group.conflicts = self.conflicts
+            group.applied = self.applied
+            group.mark_dirty()
+        for cell, units in zip(self.cells, self.shape.cell_units):
+            cell.groups = tuple(self.groups[u] for u in units)
+            cell.trail = self.trail
 
     def check_table_validity(self):
-        for group in self.groups:
-            if not group.check_group_validity():
-                return False
-        else:
-            return True
+        """
+        No contradiction anywhere. The groups report them as they come up,
+        so this does not need to look at them.
+        """
+        return not self.conflicts
+
+    def to_grid(self):
+        """
+        The table as a nested list, with None for cells that are not settled
+        to a single value.
+        """
+        mask_values = self.shape.mask_values
+        return [[mask_values[cell.mask][0] if len(mask_values[cell.mask]) == 1
+                 else None for cell in row] for row in self.table]
+
+    def to_candidates(self):
+        """
+        The candidates of every cell, as a nested list of value tuples.
+        """
+        mask_values = self.shape.mask_values
+        return [[mask_values[cell.mask] for cell in row]
+                for row in self.table]
 
     def to_string(self):
         ans = []
+        box = self.shape.box
         for row_num, row in enumerate(self.table):
             ans.append(self.line)
-            if not row_num % 3:
+            if not row_num % box:
                 ans.append(self.line)
-            for i in xrange(3):
+            for i in xrange(box):
                 ans.append(self.get_line_i(i, row))
         ans.append(self.line)
         ans.append(self.line)
         return '\n'.join(ans)
 
     def get_line_i(self, i, cells):
-        assert i in [0, 1, 2]
-        assert len(cells) == 9
+        box = self.shape.box
+        assert 0 <= i < box
+        assert len(cells) == self.shape.size
         ans = []
         for v, cell in enumerate(cells):
-            if not v % 3:
+            if not v % box:
                 ans.append(' | ')
             tmp = []
-            for j in range(3*i+1, 3*i+4):
-                tmp.append('%s' % j if j in cell.possible_vals else ' ')
+            for j in range(box*i+1, box*i+box+1):
+                tmp.append(SYMBOLS[j - 1] if cell.mask >> (j - 1) & 1 else ' ')
             ans.append(''.join(tmp))
         return '%s%s' % (' ', ' - '.join(ans))
 
-    def solve(self, explain=True):
-        old_outer, old = None, None
-        new = ''
-        i = 0
-        if explain:
+    def set_sink(self, sink):
+        """
+        Send Explanations to sink, a callable taking one, or stop explaining
+        with None.
+        """
+        self.sink = sink
+        for group in self.groups:
+            group.sink = sink
+
+    def explain(self, technique, group=None, values=(), cells=(),
+                related=None):
+        if self.sink is not None:
+            self.sink(Explanation(technique, group, values, cells, related))
+
+    def print_explanation(self, explanation):
+        """
+        The default sink, printing the explanations and boards for humans.
+        """
+        technique = explanation.technique
+        group, values = explanation.group, explanation.values
+        if technique == 'initial':
             print('INITIAL PROBLEM')
             print(self.to_string())
+        elif technique == 'board':
+            print(self.to_string())
+        elif technique == 'single':
+            other_group_kinds = sorted(
+                set(['square', 'row', 'column']).difference([group[0]]))
+            args = (values[0], group[0], group[1],
+                    other_group_kinds[0], other_group_kinds[1])
+            print(('There is only one cell that can contain the value %s in'
+                   ' %s #%s! Adjusting the appropriate %s and %s'
+                   ' accordingly.' % args))
+        elif technique == 'fit':
+            print(('In %s #%s, there are %s cells with only possible values'
+                   ' %s, so the other cells in this %s cannot contain any of'
+                   ' %s' % (group[0], group[1], len(values), list(values),
+                            group[0], list(values))))
+        elif technique == 'spot':
+            print(('In %s #%s, the values %s can only be in %s cells. So those'
+                   ' cells cannot contain any other value'
+                   % (group[0], group[1], list(values), len(values))))
+        elif technique == 'relate':
+            args = (values[0], group[0], group[1],
+                    explanation.related[0], explanation.related[1])
+            print(('The value %s in %s #%s has to be placed in cells that'
+                   ' are in order, so the other cells in %s #%s cannot '
+                   'contain them. Eliminating those possibilities.' % args))
+        elif technique in ('x_wing', 'swordfish', 'fish'):
+            kind, numbers = group
+            other_kind, other_numbers = explanation.related
+            print(('In the %ss %s, the value %s can only be in the %ss %s, '
+                   'so the other cells of those %ss cannot contain it (%s).'
+                   % (kind, list(numbers), values[0], other_kind,
+                      list(other_numbers), other_kind,
+                      technique.replace('_', '-'))))
+        elif technique == 'xy_wing':
+            pivot, a, b = explanation.related
+            print(('The cell at row #%s, column #%s holds %s or %s, and the '
+                   'cells it sees at row #%s, column #%s and row #%s, '
+                   'column #%s hold %s along with them, so cells seeing '
+                   'both of those cannot contain %s (XY-wing).'
+                   % (pivot + values[:2] + a + b + (values[2], values[2]))))
+        elif technique == 'coloring':
+            print(('Following the pairs of places of the value %s, it '
+                   'cannot be in the cells %s (coloring).'
+                   % (values[0], list(explanation.cells))))
+        elif technique == 'stalled':
+            print('Couldn\'t solve this Sudoku :( Switching to trial/error')
+        elif technique == 'guess':
+            print('Trying %s in row #%s, column #%s' %
+                  ((values[0],) + explanation.cells[0]))
+        elif technique == 'undo':
+            print('%s in row #%s, column #%s leads to a contradiction, '
+                  'undoing it.' % ((values[0],) + explanation.cells[0]))
+        elif technique == 'deadline':
+            print('Out of time, stopping here.')
+        elif technique == 'max_nodes':
+            print('Out of guesses, stopping here.')
+        elif technique == 'solved':
+            print('SOLVED!')
+        elif technique == 'unsolvable':
+            print('This Sudoku is not solvable')
 
-        while old_outer != new and not self.solved:
-            valid = self.check_table_validity()
-            while old != new and not self.solved and valid:
-                valid = self.check_table_validity()
-                if not valid:
-                    print('This Sudoku is not solvable')
-                    return False
-                    break
-                i += 1
-                old = new
-                self.solve_single_pass_no_relating(explain)
-                new = self.to_string()
-                if explain:
-                    print new
-                if all([row.is_solved() for row in self.rows]):
-                    self.solved = True
-                    print('SOLVED!')
-                    break
-                    return True
-            else:
-                old_outer = new
-                self.relate_groups()
-                new = self.to_string()
-                if all([row.is_solved() for row in self.rows]):
-                    self.solved = True
+    def solve(self, explain=True, sink=None, engine='table', deadline=None,
+              max_nodes=None):
+        """
+        Solve the table in place, returning a SolveResult, true on success.
+        With explain, every step goes to sink, printing them by default.
+        Without it nothing is formatted or printed.
+
+        deadline (a time.time()) and max_nodes (guesses) bound the work.
+        Propagation and search check them as they go, and when either runs
+        out, solve stops with that as the status. The table then holds
+        what was deduced for sure, and solving it again carries on from
+        there: the propagation where it stopped, a search from the start.
+
+        engine='dlx' skips the human style techniques and hands the current
+        candidates to SudokuDLX instead; only the outcome is explained, and
+        there is no budget.
+        """
+        start, nodes = default_timer(), self.nodes
+        applied = dict(self.applied)
+        if sink is None and explain:
+            sink = self.print_explanation
+        self.set_sink(sink if explain else None)
+        self.explain('initial')
+        if engine == 'dlx':
+            status = 'solved' if self.solve_dlx() else 'unsolvable'
+            self.explain(status)
+        else:
+            self.deadline = deadline
+            self.node_limit = None if max_nodes is None else nodes + max_nodes
+            self.stopped = None
+            try:
+                status = self.solve_table(explain)
+            finally:
+                self.deadline = self.node_limit = None
+        techniques = dict((key, n - applied.get(key, 0))
+                          for key, n in self.applied.iteritems()
+                          if n > applied.get(key, 0))
+        return SolveResult(status, self.to_candidates(), techniques,
+                           self.nodes - nodes, default_timer() - start)
+
+    def solve_table(self, explain=True):
+        valid = self.deduce(explain)
+        if valid and not self.solved and not self.stopped:
+            self.explain('stalled')
+            mark = len(self.trail)
+            valid = self.search(explain)
+            if self.stopped:
+                # keep what is known for sure, not the guesses
+                self.undo(mark)
+        status = self.stopped or ('solved' if valid else 'unsolvable')
+        self.explain(status)
+        return status
+
+    def solve_dlx(self):
+        dlx = SudokuDLX(self.to_grid(), [cell.mask for cell in self.cells])
+        solution = dlx.solve()
+        self.nodes += dlx.nodes
+        if solution is None:
+            return False
+        for cell, val in zip(self.cells, [v for row in solution for v in row]):
+            cell.restrict_mask(1 << (val - 1))
+        self.solved = True
+        return True
+
+    def out_of_budget(self):
+        """
+        Whether the budget of the current solve ran out, noting which part
+        of it in self.stopped.
+        """
+        if self.stopped:
+            return True
+        if self.deadline is not None and time.time() > self.deadline:
+            self.stopped = 'deadline'
+        elif self.node_limit is not None and self.nodes >= self.node_limit:
+            self.stopped = 'max_nodes'
+        return self.stopped is not None
+
+    def deduce(self, explain=True):
+        """
+        Apply fit/spot and relate_groups, and the extra techniques when
+        those are stuck, until nothing finds anything new.
+        Returns False if the table turned out to be contradictory. Stops
+        early, with the table valid as far as it got, when the budget runs
+        out.
+        """
+        while True:
+            self.propagate(explain)
+            if not self.check_table_validity():
+                return False
+            if all([row.is_solved() for row in self.rows]):
+                self.solved = True
+                return True
+            if self.stopped:
+                return True
+            if explain:
+                self.explain('board')
+            if self.relating and self.stats is not None:
+                self.relate_groups_profiled(explain)
+            elif self.relating:
+                self.relate_groups(explain)
+            if not self.queue and self.extra_techniques:
+                self.use_extra_techniques(explain)
+            if not self.queue:
+                # relating the groups and the extra techniques did not
+                # eliminate anything either
+                return True
+
+    def search(self, explain=True):
+        """
+        Trial and error: guess each candidate of the cell with the fewest
+        of them, deduce from there, and undo the guess if it leads to a
+        contradiction. Returns True once the table is solved, False if it
+        cannot be or the budget ran out, leaving the guesses in place then.
+        """
+        cell, vals = self.pick_cell()
+        explain = explain and self.sink is not None
+        for val in vals:
+            if self.out_of_budget():
+                return False
+            self.nodes += 1
+            mark = len(self.trail)
+            if explain:
+                self.explain('guess', values=(val,), cells=(cell.position,))
+            cell.restrict_mask(1 << (val - 1))
+            if self.deduce(explain) and (self.solved or self.search(explain)):
+                return True
+            if self.stopped:
+                return False
+            if explain:
+                self.explain('undo', values=(val,), cells=(cell.position,))
+            self.undo(mark)
+        return False
+
+    def pick_cell(self):
+        """
+        The cell for search to guess: one with the fewest candidates left,
+        and the values to try in it.
+        """
+        mask_count = self.shape.mask_count
+        cell, count = None, self.shape.size + 1
+        for candidate in self.cells:
+            candidate_count = mask_count[candidate.mask]
+            if 1 < candidate_count < count:
+                cell, count = candidate, candidate_count
+                if count == 2:
                     break
-                elif explain:
-                    print new
-        if not self.solved and valid:
-            print('Couldn\'t solve this Sudoku :( Switching to trial/error')
-            # XXX: implement trial error
-            return
-        if not explain:
-            print(self.to_string())
+        vals = self.shape.mask_values[cell.mask]
+        if self.rng is not None:
+            vals = self.rng.sample(vals, len(vals))
+        return cell, vals
+
+    def count_solutions(self, limit=2):
+        """
+        How many solutions the table has, counting no further than limit:
+        with the default, 0, 1 or 2 for none, unique and several. The search
+        stops as soon as limit is reached, and the table is left as it was.
+        """
+        mark = len(self.trail)
+        count = self.count_search(limit) if self.deduce(False) else 0
+        self.undo(mark)
+        # the groups may not have been looked at since their last changes
+        for group in self.groups:
+            group.mark_dirty()
+        return count
+
+    def count_search(self, limit):
+        """
+        search that goes on past the first solution, for count_solutions.
+        """
+        if self.solved:
+            return 1
+        cell, vals = self.pick_cell()
+        count = 0
+        for val in vals:
+            self.nodes += 1
+            mark = len(self.trail)
+            cell.restrict_mask(1 << (val - 1))
+            if self.deduce(False):
+                count += self.count_search(limit - count)
+            self.undo(mark)
+            if count >= limit:
+                break
+        return count
+
+    def undo(self, mark):
+        """
+        Roll the cells and groups back to the state they had when the trail
+        was mark entries long.
+        """
+        trail = self.trail
+        while len(trail) > mark:
+            obj, state = trail.pop()
+            obj.restore(state)
+        self.queue.clear()
+        for group in self.groups:
+            group.dirty = False
+        self.conflicts[:] = [group for group in self.groups
+                             if group.n_conflicts]
+        self.solved = all([row.is_solved() for row in self.rows])
+
+    def snapshot(self, mark=None):
+        """
+        The state of the table as a small picklable tuple: the board size,
+        the candidate masks of the cells, and how many masks each group has
+        settled followed by those masks, packed as arrays of ints. Loading
+        it back with load_snapshot (or table_from_snapshot) is much cheaper
+        than copying or pickling the cells and groups.
+
+        With a mark, the state the table had when the trail was that long:
+        the entries past it are played back in reverse on the copy, the
+        table itself is left as it is.
+        """
+        size = self.shape.size
+        masks = [cell.mask for cell in self.cells]
+        n_settled = [len(group.settled_masks) for group in self.groups]
+        if mark is not None:
+            for obj, state in reversed(self.trail[mark:]):
+                if isinstance(obj, SudokuCell):
+                    row, col = obj.position
+                    masks[(row - 1) * size + col - 1] = state
+                else:
+                    n_settled[obj.index] = state
+        return (size,
+                array('I', masks).tostring(),
+                array('B', n_settled).tostring(),
+                array('I', [mask for group, n in zip(self.groups, n_settled)
+                            for mask in group.settled_masks[:n]]).tostring())
+
+    def load_snapshot(self, snapshot):
+        """
+        Put the table in the state of a snapshot of a table of its size.
+        The trail starts over from there, undo cannot go back past it.
+        """
+        size, masks, n_settled, settled = snapshot
+        assert size == self.shape.size
+        for cell, mask in zip(self.cells, array('I', masks)):
+            if cell.mask != mask:
+                cell.restore(mask)
+        settled = iter(array('I', settled))
+        for group, n in zip(self.groups, array('B', n_settled)):
+            group.settled_masks[:] = islice(settled, n)
+        del self.trail[:]
+        self.places = None
+        self.undo(0)
+        for group in self.groups:
+            group.mark_dirty()
+
+    def propagate(self, explain=True):
+        """
+        Run fit/spot on dirty groups until none are left, or until there
+        is a contradiction. Eliminations made along the way re-queue only
+        the row, column and square they touch.
+        """
+        if self.stats is not None:
+            return self.propagate_profiled(explain)
+        queue, conflicts = self.queue, self.conflicts
+        budgeted = self.deadline is not None
+        while queue and not conflicts:
+            if budgeted and self.out_of_budget():
+                return
+            group = queue.popleft()
+            group.dirty = False
+            for n in self.subset_sizes:
+                group.fit(n, explain)
+                group.spot(n, explain)
+
+    def use_techniques(self, difficulty):
+        """
+        Narrow the techniques to those of one of DIFFICULTIES. The groups
+        are queued again, so a table deduced with fewer techniques carries
+        on from where it got to.
+        """
+        (self.subset_sizes, self.relating,
+         self.extra_techniques) = TECHNIQUES[difficulty]
+        for group in self.groups:
+            group.mark_dirty()
+
+    def enable_stats(self):
+        """
+        Count calls, combinations tried and fired, candidates eliminated and
+        time spent per technique and subset size into self.stats. Tables
+        without stats take the unprofiled code paths.
+        """
+        self.stats = {}
+
+    def record(self, technique, n, tried, fired, eliminated, seconds):
+        stats = self.stats.get((technique, n))
+        if stats is None:
+            stats = self.stats[technique, n] = TechniqueStats()
+        stats.calls += 1
+        stats.tried += tried
+        stats.fired += fired
+        stats.eliminated += eliminated
+        stats.seconds += seconds
+
+    def propagate_profiled(self, explain=True):
+        queue, mask_count = self.queue, self.shape.mask_count
+        while queue and not self.conflicts:
+            if self.out_of_budget():
+                return
+            group = queue.popleft()
+            group.dirty = False
+            for n in self.subset_sizes:
+                for technique in ('fit', 'spot'):
+                    settled = len(group.settled_masks)
+                    before = sum([mask_count[cell.mask]
+                                  for i, cell in group.cells])
+                    start = default_timer()
+                    tried = getattr(group, technique)(n, explain)
+                    seconds = default_timer() - start
+                    after = sum([mask_count[cell.mask]
+                                 for i, cell in group.cells])
+                    self.record(technique, n, tried,
+                                len(group.settled_masks) - settled,
+                                before - after, seconds)
+
+    def relate_groups_profiled(self, explain=True):
+        mask_count = self.shape.mask_count
+        before = sum([mask_count[cell.mask] for cell in self.cells])
+        start = default_timer()
+        fired = self.relate_groups(explain)
+        seconds = default_timer() - start
+        after = sum([mask_count[cell.mask] for cell in self.cells])
+        self.record('relate', None, self.shape.size * len(self.groups), fired,
+                    before - after, seconds)
 
     def identify_group(self, i):
-        return i // 9, i % 9
+        return divmod(i, self.shape.size)
 
     def get_related_group(self, gtype, num, relation):
-        relation = set(relation)
-        if gtype == 'sq3' and \
-                any([relation.issubset(tmp)
-                     for tmp in [set('123'), set('456'), set('789')]]):
-            # row
-            ans = (num // 3) * 3 + relation.issubset(set('456')) + \
-                2 * relation.issubset(set('789'))
-            return ans
-        elif gtype == 'sq3':
-            # column
-            ans = 9 + (num % 3) * 3 + relation.issubset(set('258')) + \
-                2 * relation.issubset(set('369'))
-            return ans
-        elif gtype == 'row':
-            # square
-            ans = 18 + (num // 3) * 3
-            ans += relation.issubset(set('456')) + \
-                2 * relation.issubset(set('789'))
-            return ans
-        else:  # column
-            # square
-            ans = 18 + (num // 3) + 3 * (
-                relation.issubset(set('456')) +
-                2 * relation.issubset(set('789')))
-            return ans
-
-    def clean_related_group(self, related_group, group, val):
-        donottouch = map(itemgetter(1), group.cells)
-        for i, cell in related_group.cells:
-            if cell not in donottouch:
-                cell.eliminate_possibilities(val)
-        args = (val, group.group_kind, group.id_num + 1,
-                related_group.group_kind, related_group.id_num + 1)
-        print(('The value %s in %s #%s has to be placed in cells that'
-               ' are in order, so the other cells in %s #%s cannot '
-               'contain them. Eliminating those possibilities.' % args))
-
-    def relate_groups(self):
-        for i, group in enumerate(self.groups):
-            for n in xrange(1, 10):
-                relation, n = group.could_relate(n)
-                if not relation:
+        size = self.shape.size
+        offset = {'row': 0, 'col': size, 'sq3': 2 * size}[gtype]
+        places = sum(1 << SYMBOLS.index(i) for i in relation)
+        return self.shape.related_groups[offset + num][places]
+
+    def clean_related_group(self, related_group, group, val, explain=True):
+        """
+        Eliminate val from the cells of related_group outside group.
+        Returns whether there was any to eliminate.
+        """
+        bit = 1 << (val - 1)
+        cells = self.cells
+        difference = self.shape.group_difference[group.index]
+        eliminated = [cells[c] for c in difference[related_group.index]
+                      if cells[c].mask & bit]
+        for cell in eliminated:
+            cell.eliminate_mask(bit)
+        if eliminated and explain and self.sink is not None:
+            self.explain('relate', (group.group_kind, group.id_num + 1),
+                         (val,), tuple(cell.position for cell in eliminated),
+                         (related_group.group_kind, related_group.id_num + 1))
+        return bool(eliminated)
+
+    def relate_groups(self, explain=True):
+        """
+        Returns how many values turned out to be confined to another group
+        with room left for them outside this one.
+        """
+        groups = self.groups
+        fired = 0
+        for group in groups:
+            related = self.shape.related_groups[group.index]
+            for n, places in enumerate(group.value_places()):
+                related_index = related.get(places)
+                if related_index is None:
                     continue
-                # grab what squares it relates to and eliminate possibilites
-                gtype, num = self.identify_group(i)
-                gtype = {0: 'row', 1: 'col', 2: 'sq3'}[gtype]
-                related_index = self.get_related_group(gtype, num, relation)
-                # print ('I am %s number %s, interesting value is %s'
-                #        ' and it relates to group %s') % (gtype, num + 1, n,
-                #                                          related_index)
-                related_group = self.groups[related_index]
-                self.clean_related_group(related_group, group, n)
+                # eliminate n from the rest of the group it relates to
+                if self.clean_related_group(groups[related_index], group, n,
+                                            explain):
+                    fired += 1
+        self.note_applied('relate', fired)
+        return fired
+
+    def note_applied(self, technique, fired):
+        if fired:
+            self.applied[technique, None] = (
+                self.applied.get((technique, None), 0) + fired)
+
+    def use_extra_techniques(self, explain=True):
+        """
+        Run extra_techniques, cheapest first, until one of them eliminates
+        something (or runs into a contradiction), so that fit/spot get the
+        next go.
+        """
+        mask_count = self.shape.mask_count
+        # they all start from the same state, see group_places
+        self.places = None
+        for technique in self.extra_techniques:
+            if self.stats is not None:
+                before = sum([mask_count[cell.mask] for cell in self.cells])
+                start = default_timer()
+                fired = getattr(self, technique)(explain)
+                seconds = default_timer() - start
+                after = sum([mask_count[cell.mask] for cell in self.cells])
+                # tried is not counted for these
+                self.record(technique, None, 0, fired, before - after,
+                            seconds)
+            else:
+                fired = getattr(self, technique)(explain)
+            self.note_applied(technique, fired)
+            if self.queue or self.conflicts:
+                return
+
+    def group_places(self):
+        """
+        value_places of every group, worked out once per round of the extra
+        techniques. Their own eliminations leave these out of date, but
+        only ever with more places than there are, and the fish and pairs
+        they find in those still hold.
+        """
+        if self.places is None:
+            self.places = [group.value_places() for group in self.groups]
+        return self.places
+
+    def x_wing(self, explain=True):
+        return self.fish(2, explain)
+
+    def swordfish(self, explain=True):
+        return self.fish(3, explain)
+
+    def fish(self, n, explain=True):
+        """
+        X-Wing (n = 2), Swordfish (n = 3) and so on: when the places left
+        for a value in n rows all lie in the same n columns, those rows
+        take the value in each of those columns, so the other cells of the
+        columns cannot. The same goes with rows and columns swapped.
+        Returns how many fish eliminated something.
+        """
+        size = self.shape.size
+        mask_count = self.shape.mask_count
+        technique = {2: 'x_wing', 3: 'swordfish'}.get(n, 'fish')
+        explain = explain and self.sink is not None
+        fired = 0
+        group_places = self.group_places()
+        for base, cover in ((self.rows, self.columns),
+                            (self.columns, self.rows)):
+            places = [group_places[group.index] for group in base]
+            for val in xrange(1, size + 1):
+                bit = 1 << (val - 1)
+                lines = [(i, places[i][val]) for i in xrange(size)
+                         if 1 < mask_count[places[i][val]] <= n]
+                for nuple in combinations(lines, n):
+                    union = 0
+                    for i, line_places in nuple:
+                        union |= line_places
+                    if mask_count[union] != n:
+                        continue
+                    base_lines = set([i for i, line_places in nuple])
+                    eliminated = [
+                        cell for pos in xrange(size) if union >> pos & 1
+                        for i, cell in cover[pos].cells
+                        if i - 1 not in base_lines and cell.mask & bit]
+                    if not eliminated:
+                        continue
+                    fired += 1
+                    for cell in eliminated:
+                        cell.eliminate_mask(bit)
+                    if explain:
+                        self.explain(
+                            technique,
+                            (base[0].group_kind,
+                             tuple(sorted(i + 1 for i in base_lines))),
+                            (val,),
+                            tuple(cell.position for cell in eliminated),
+                            (cover[0].group_kind,
+                             tuple(pos + 1 for pos in xrange(size)
+                                   if union >> pos & 1)))
+        return fired
+
+    def xy_wing(self, explain=True):
+        """
+        XY-Wing: a cell with the candidates x and y only, seeing a cell
+        with x and z only and another with y and z only. Whichever of x and
+        y the first cell holds, one of the other two holds z, so no cell
+        seeing both of those can. Returns how many wings eliminated
+        something.
+        """
+        mask_count, mask_values = self.shape.mask_count, self.shape.mask_values
+        peers, peer_sets = self.shape.peers, self.shape.peer_sets
+        cells = self.cells
+        explain = explain and self.sink is not None
+        fired = 0
+        for pivot, pivot_cell in enumerate(cells):
+            xy = pivot_cell.mask
+            if mask_count[xy] != 2:
+                continue
+            wings = [c for c in peers[pivot]
+                     if mask_count[cells[c].mask] == 2 and
+                     mask_count[cells[c].mask & xy] == 1]
+            for a, b in combinations(wings, 2):
+                z = cells[a].mask & cells[b].mask
+                if mask_count[z] != 1 or z & xy:
+                    continue
+                eliminated = [cells[c] for c in peer_sets[a] & peer_sets[b]
+                              if cells[c].mask & z]
+                if not eliminated:
+                    continue
+                fired += 1
+                for cell in eliminated:
+                    cell.eliminate_mask(z)
+                if explain:
+                    self.explain(
+                        'xy_wing', None,
+                        mask_values[xy] + mask_values[z],
+                        tuple(cell.position for cell in eliminated),
+                        (pivot_cell.position, cells[a].position,
+                         cells[b].position))
+        return fired
+
+    def coloring(self, explain=True):
+        """
+        Simple coloring: where a value has two places left in a group, one
+        of them holds it. Chains of such pairs color their cells in two
+        colors, one of which holds the value everywhere and the other
+        nowhere. A color with two cells in the same group is the one that
+        does not; and a cell seeing both colors cannot hold the value
+        either way. Returns how many chains eliminated something.
+        """
+        size = self.shape.size
+        mask_count, units = self.shape.mask_count, self.shape.units
+        peer_sets = self.shape.peer_sets
+        cells = self.cells
+        explain = explain and self.sink is not None
+        places = self.group_places()
+        fired = 0
+        for val in xrange(1, size + 1):
+            bit = 1 << (val - 1)
+            links = {}
+            for g, group_places in enumerate(places):
+                if mask_count[group_places[val]] == 2:
+                    a, b = [units[g][pos] for pos in xrange(size)
+                            if group_places[val] >> pos & 1]
+                    links.setdefault(a, []).append(b)
+                    links.setdefault(b, []).append(a)
+            holders = None
+            color = {}
+            for start in links:
+                if start in color:
+                    continue
+                color[start] = 0
+                chain = [start]
+                for c in chain:
+                    for d in links[c]:
+                        if d not in color:
+                            color[d] = 1 - color[c]
+                            chain.append(d)
+                sides = ([c for c in chain if not color[c]],
+                         [c for c in chain if color[c]])
+                eliminated = []
+                for side in sides:
+                    if not all([peer_sets[c].isdisjoint(side)
+                                for c in side]):
+                        eliminated = [cells[c] for c in side
+                                      if cells[c].mask & bit]
+                        break
+                else:
+                    if holders is None:
+                        holders = [c for c, cell in enumerate(cells)
+                                   if cell.mask & bit]
+                    eliminated = [
+                        cells[c] for c in holders
+                        if c not in color and cells[c].mask & bit and
+                        not peer_sets[c].isdisjoint(sides[0]) and
+                        not peer_sets[c].isdisjoint(sides[1])]
+                if not eliminated:
+                    continue
+                fired += 1
+                for cell in eliminated:
+                    cell.eliminate_mask(bit)
+                if explain:
+                    self.explain('coloring', None, (val,),
+                                 tuple(cell.position for cell in eliminated))
+        return fired
 
     def solve_single_pass_no_relating(self, explain=True):
         for group in self.groups:
@@ -378,16 +1594,1130 @@ class SudokuTable(object):
 #     def solve(self):
 
 
+def incidence_matrix(rows, n_cols):
+    matrix = np.zeros((len(rows), n_cols), np.float32)
+    for i, cols in enumerate(rows):
+        matrix[i, cols] = 1
+    return matrix
+
+
+def batch_dot(matrix, x):
+    """
+    matrix times x along the first (cell or group) axis of x.
+    """
+    ans = np.dot(matrix, x.reshape(x.shape[0], -1))
+    return ans.reshape((matrix.shape[0],) + x.shape[1:])
+
+
+class SudokuBatch(object):
+    """
+    Many puzzles of one size at once. The candidates of N puzzles live in a
+    single (N, cells, values) boolean tensor, and naked singles, hidden
+    singles and the square/line eliminations of relate_groups are applied
+    to all of them together as matrix products over the cell axis. Puzzles
+    leave the batch as soon as they are solved, turn out contradictory or
+    stop making progress; only the stalled ones go on to SudokuTable's
+    search.
+    """
+
+    SOLVED = 'solved'
+    UNSOLVABLE = 'unsolvable'
+    STALLED = 'stalled'
+
+    def __init__(self, tables):
+        """
+        tables is an (N, 81) or (N, 9, 9) integer array (or the same for
+        another size) with 0 for empty cells, or an iterable of puzzles as
+        as_table takes them.
+        """
+        if isinstance(tables, np.ndarray):
+            givens = tables.reshape(len(tables), -1)
+        else:
+            givens = np.array(
+                [[val or 0 for row in table for val in row]
+                 for table in map(as_table, tables)], np.uint8)
+        self.shape = get_shape(int(round(givens.shape[-1] ** 0.5)))
+        size = self.shape.size
+        givens = givens.reshape(-1, self.shape.n_cells)
+        self.candidates = np.ones(givens.shape + (size,), bool)
+        given = givens > 0
+        self.candidates[given] = np.eye(size, dtype=bool)[givens[given] - 1]
+        self.status = [None] * len(givens)
+        self.nodes = 0  # guesses made by the searches of stalled puzzles
+
+    def __len__(self):
+        return len(self.status)
+
+    def propagate(self):
+        """
+        Eliminate until every puzzle is solved, unsolvable or stalled, and
+        record which in self.status.
+        """
+        unit_matrix = self.shape.matrices().unit
+        idx = np.arange(len(self))
+        # cells first, so the matrix products need no transposing
+        x = self.candidates.transpose(1, 0, 2).astype(np.float32)
+        while idx.size:
+            before = x.sum(2).sum(0)
+            x = self.eliminate(x)
+            cell_counts = x.sum(2)
+            unit_counts = batch_dot(unit_matrix, x)
+            unsolvable = (cell_counts == 0).any(0) | \
+                (unit_counts == 0).any(2).any(0)
+            solved = (cell_counts == 1).all(0) & \
+                (unit_counts == 1).all(2).all(0)
+            stalled = cell_counts.sum(0) == before
+            finished = unsolvable | solved | stalled
+            for k, i in enumerate(idx):
+                if unsolvable[k]:
+                    self.status[i] = self.UNSOLVABLE
+                elif solved[k]:
+                    self.status[i] = self.SOLVED
+                elif stalled[k]:
+                    self.status[i] = self.STALLED
+            self.candidates[idx[finished]] = \
+                x[:, finished].transpose(1, 0, 2) > 0
+            x, idx = x[:, ~finished], idx[~finished]
+
+    def eliminate(self, x):
+        """
+        One round of naked singles, hidden singles and square/line
+        eliminations on a (cells, n, values) candidate array.
+        """
+        m = self.shape.matrices()
+        # naked singles: a settled value is removed from all the peers
+        singles = x * (x.sum(2) == 1)[:, :, None]
+        x[batch_dot(m.peer, singles) > 0] = 0
+        # hidden singles: the only place for a value in some group
+        unit_counts = batch_dot(m.unit, x)
+        hidden = (batch_dot(m.unit.T, (unit_counts == 1).astype(
+            np.float32)) > 0) & (x > 0)
+        x = np.where(hidden.any(2)[:, :, None], hidden, x).astype(np.float32)
+        # a value whose places in a square are all on one line is removed
+        # from the rest of that line, and vice versa
+        unit_counts = batch_dot(m.unit, x)
+        segment_counts = batch_dot(m.segment, x)
+        in_segment = segment_counts > 0
+        pointing = in_segment & \
+            (segment_counts == unit_counts[m.segment_squares])
+        claiming = in_segment & \
+            (segment_counts == unit_counts[m.segment_lines])
+        x[(batch_dot(m.line_rest, pointing.astype(np.float32)) +
+           batch_dot(m.square_rest, claiming.astype(np.float32))) > 0] = 0
+        return x
+
+    def to_table(self, k):
+        """
+        A SudokuTable starting from the current candidates of puzzle k.
+        """
+        size = self.shape.size
+        masks = self.candidates[k].dot(1 << np.arange(size))
+        sudoku = []
+        for row in masks.reshape(size, size):
+            sudoku.append([])
+            for mask in row:
+                cell = SudokuCell(None, size)
+                cell.mask = int(mask)
+                sudoku[-1].append(cell)
+        return SudokuTable(sudoku)
+
+    def solve(self, deadline=None):
+        """
+        Returns the solved nested list of every puzzle, None for those
+        without a solution. Past the deadline (a time.time()), those left
+        to search are 'deadline' instead.
+        """
+        self.propagate()
+        solutions = []
+        for k, status in enumerate(self.status):
+            if status == self.SOLVED:
+                values = self.candidates[k].argmax(1) + 1
+                solutions.append(values.reshape(
+                    self.shape.size, self.shape.size).tolist())
+                continue
+            S = None if status == self.UNSOLVABLE else self.to_table(k)
+            if S is None:
+                solutions.append(None)
+                continue
+            status = S.solve(explain=False, deadline=deadline).status
+            if status == 'solved':
+                solutions.append(S.to_grid())
+            else:
+                solutions.append(None if status == 'unsolvable' else status)
+            if S is not None:
+                self.nodes += S.nodes
+        return solutions
+
+
+class SudokuDLX(object):
+    """
+    Sudoku as an exact cover problem, solved with Knuth's Algorithm X on
+    dancing links. Every (cell, value) pair is a row covering four of the
+    4 * cells columns (324 on a 9x9 board): the cell is filled, and the
+    value is placed in its row, its column and its square. There are no
+    explanations here, just solutions, and it can tell 0, 1 or more of them
+    apart.
+
+    The links live in flat lists indexed by node (0 is the root, then come
+    the column headers) rather than in node objects.
+    """
+
+    def __init__(self, table, candidates=None, rng=None):
+        """
+        table is the same nested list get_sudoku_table takes. candidates, a
+        list of one mask per cell, can narrow the values allowed in each.
+        With a random.Random as rng, rows are tried in random order.
+        """
+        self.shape = shape = get_shape(len(table))
+        n_columns = 4 * shape.n_cells
+        nodes = range(n_columns + 1)
+        self.L = [i - 1 for i in nodes]
+        self.R = [i + 1 for i in nodes]
+        self.L[0], self.R[n_columns] = n_columns, 0
+        self.U, self.D, self.C = nodes[:], nodes[:], nodes[:]
+        self.S = [0] * (n_columns + 1)
+        self.row_of = [None] * (n_columns + 1)
+        self.nodes = 0  # rows tried by search
+        self.consistent = True
+        givens = [val for row in table for val in row]
+        rows = []
+        for cell, given in enumerate(givens):
+            if candidates is None:
+                mask = shape.full_mask
+            else:
+                mask = candidates[cell]
+            if given is not None:
+                mask &= 1 << (given - 1)
+            rows.extend((cell, val) for val in shape.mask_values[mask])
+        if rng is not None:
+            rng.shuffle(rows)
+        for row in rows:
+            self.add_row(row)
+        # the givens are part of every solution: take their rows right away
+        self.chosen = []
+        for cell, given in enumerate(givens):
+            if given is None:
+                continue
+            column = cell + 1
+            if self.column_covered(column) or not self.S[column]:
+                self.consistent = False
+                break
+            row = self.D[column]
+            for node in self.row_nodes(row):
+                if self.column_covered(self.C[node]):
+                    self.consistent = False
+                    break
+            if not self.consistent:
+                break
+            self.select(row)
+            self.chosen.append(self.row_of[row])
+
+    def add_row(self, row):
+        cell, val = row
+        size, n_cells = self.shape.size, self.shape.n_cells
+        r, c = divmod(cell, size)
+        box = self.shape.box * (r // self.shape.box) + c // self.shape.box
+        first = None
+        for column in (cell + 1, 1 + n_cells + size * r + val - 1,
+                       1 + 2 * n_cells + size * c + val - 1,
+                       1 + 3 * n_cells + size * box + val - 1):
+            node = len(self.C)
+            self.C.append(column)
+            self.row_of.append(row)
+            # at the bottom of the column
+            self.U.append(self.U[column])
+            self.D.append(column)
+            self.D[self.U[column]] = node
+            self.U[column] = node
+            self.S[column] += 1
+            # at the end of the row
+            if first is None:
+                first = node
+                self.L.append(node)
+                self.R.append(node)
+            else:
+                self.L.append(self.L[first])
+                self.R.append(first)
+                self.R[self.L[first]] = node
+                self.L[first] = node
+
+    def column_covered(self, column):
+        return self.R[self.L[column]] != column
+
+    def row_nodes(self, row):
+        node = row
+        while True:
+            yield node
+            node = self.R[node]
+            if node == row:
+                return
+
+    def cover(self, column):
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        R[L[column]] = R[column]
+        L[R[column]] = L[column]
+        i = D[column]
+        while i != column:
+            j = R[i]
+            while j != i:
+                D[U[j]] = D[j]
+                U[D[j]] = U[j]
+                S[C[j]] -= 1
+                j = R[j]
+            i = D[i]
+
+    def uncover(self, column):
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        i = U[column]
+        while i != column:
+            j = L[i]
+            while j != i:
+                S[C[j]] += 1
+                D[U[j]] = j
+                U[D[j]] = j
+                j = L[j]
+            i = U[i]
+        R[L[column]] = column
+        L[R[column]] = column
+
+    def select(self, row):
+        """
+        Take row into the solution, covering all of its columns.
+        """
+        self.cover(self.C[row])
+        j = self.R[row]
+        while j != row:
+            self.cover(self.C[j])
+            j = self.R[j]
+
+    def deselect(self, row):
+        j = self.L[row]
+        while j != row:
+            self.uncover(self.C[j])
+            j = self.L[j]
+        self.uncover(self.C[row])
+
+    def search(self, chosen):
+        R, S, D = self.R, self.S, self.D
+        if R[0] == 0:
+            yield chosen
+            return
+        # the column with the fewest rows left
+        column, size = None, self.shape.size + 1
+        c = R[0]
+        while c != 0:
+            if S[c] < size:
+                column, size = c, S[c]
+                if size < 2:
+                    break
+            c = R[c]
+        if not size:
+            return
+        row = D[column]
+        while row != column:
+            self.nodes += 1
+            self.select(row)
+            chosen.append(self.row_of[row])
+            for solution in self.search(chosen):
+                yield solution
+            chosen.pop()
+            self.deselect(row)
+            row = D[row]
+
+    def solutions(self):
+        """
+        Generate every solution as a nested list.
+        """
+        if not self.consistent:
+            return
+        for chosen in self.search(list(self.chosen)):
+            size = self.shape.size
+            grid = [[None] * size for i in xrange(size)]
+            for cell, val in chosen:
+                grid[cell // size][cell % size] = val
+            yield grid
+
+    def solve(self):
+        """
+        The first solution found, or None.
+        """
+        for solution in self.solutions():
+            return solution
+        return None
+
+    def count_solutions(self, limit=2):
+        """
+        How many solutions there are, counting no further than limit: with
+        the default, 0, 1 or 2 for none, unique and several.
+        """
+        count = 0
+        for solution in self.solutions():
+            count += 1
+            if count >= limit:
+                break
+        return count
+
+
 def get_sudoku_table(table):
     sudoku = []
     for row in table:
         sudoku.append([])
         for val in row:
-            sudoku[-1].append(SudokuCell(val))
+            sudoku[-1].append(SudokuCell(val, len(table)))
     return SudokuTable(sudoku)
 
 
-if __name__ == '__main__':
+def parse_puzzle(line):
+    """
+    Read the usual one line format: 81 characters for a 9x9 board (256 for
+    16x16, 625 for 25x25), with SYMBOLS for clues and '0' or '.' for empty
+    cells.
+    """
+    line = line.strip()
+    size = int(round(len(line) ** 0.5))
+    if size * size != len(line) or size > len(SYMBOLS):
+        raise ValueError('Expected 81, 256, 625... characters, got %s: %r' %
+                         (len(line), line))
+    get_shape(size)
+    table = []
+    for i, char in enumerate(line):
+        if not i % size:
+            table.append([])
+        val = SYMBOLS.find(char.upper()) + 1
+        if char in '0.':
+            table[-1].append(None)
+        elif 0 < val <= size:
+            table[-1].append(val)
+        else:
+            raise ValueError('Unexpected character %r in %r' % (char, line))
+    return table
+
+
+def as_table(table):
+    """
+    A puzzle as a nested list, from a nested list, a one line string or an
+    integer array (flat or square, 0 for empty cells).
+    """
+    if isinstance(table, basestring):
+        return parse_puzzle(table)
+    if isinstance(table, np.ndarray):
+        size = int(round(table.size ** 0.5))
+        return [[val or None for val in row]
+                for row in table.reshape(size, size).tolist()]
+    return table
+
+
+def format_puzzle(table):
+    return ''.join(['.' if val is None else SYMBOLS[val - 1]
+                    for row in table for val in row])
+
+
+def solve_puzzle(table, engine='table', deadline=None):
+    """
+    Quietly solve one puzzle, given as anything as_table takes. Returns
+    the solved nested list, or None if there is no solution.
+    engine='dlx' goes straight to SudokuDLX without building a SudokuTable.
+    With a deadline (a time.time()) the table engine gives up once it is
+    past, returning 'deadline'; SudokuDLX has no budget and ignores it.
+    """
+    table = as_table(table)
+    if engine == 'dlx':
+        return SudokuDLX(table).solve()
+    S = get_sudoku_table(table)
+    if deadline is not None:
+        status = S.solve(explain=False, deadline=deadline).status
+        if status == 'solved':
+            return S.to_grid()
+        return None if status == 'unsolvable' else status
+    if S.deduce(explain=False) and (S.solved or S.search(explain=False)):
+        return S.to_grid()
+    return None
+
+
+# How many tie breaks canonical_form tries per orientation before it gives
+# up on finding every variant and breaks the rest by position.
+CANONICAL_TRIES = 64
+
+
+def rank(keys):
+    """
+    Replace keys by their rank among the distinct keys.
+    """
+    index = dict((key, i) for i, key in enumerate(sorted(set(keys))))
+    return [index[key] for key in keys]
+
+
+def refine_keys(table, rounds=3):
+    """
+    Keys for the rows and columns of a board that no relabelling of the
+    values or permutation of the rows and columns changes. Each round, a
+    row, column or value is known by what it meets of the others' keys
+    from the round before.
+    """
+    size = len(table)
+    givens = [(r, c, val) for r, row in enumerate(table)
+              for c, val in enumerate(row) if val is not None]
+    row_keys, col_keys, val_keys = [0] * size, [0] * size, [0] * (size + 1)
+    for i in xrange(rounds):
+        rows = [[] for r in xrange(size)]
+        cols = [[] for c in xrange(size)]
+        vals = [[] for v in xrange(size + 1)]
+        for r, c, val in givens:
+            rows[r].append((col_keys[c], val_keys[val]))
+            cols[c].append((row_keys[r], val_keys[val]))
+            vals[val].append((row_keys[r], col_keys[c]))
+        row_keys, col_keys, val_keys = [
+            rank([tuple(sorted(key)) for key in keys])
+            for keys in (rows, cols, vals)]
+    return row_keys, col_keys
+
+
+def tie_runs(items, key):
+    return [list(run) for k, run in groupby(sorted(items, key=key), key)]
+
+
+def count_orders(runs):
+    n = 1
+    for run in runs:
+        for i in xrange(2, len(run) + 1):
+            n *= i
+    return n
+
+
+def run_orders(runs):
+    for parts in product(*[list(permutations(run)) for run in runs]):
+        yield [item for part in parts for item in part]
+
+
+def line_orders(keys, box):
+    """
+    The orders of the rows (or columns) by band key and then by key within
+    each band, one for every way of breaking the ties, or just the one
+    breaking them by position if there are more than CANONICAL_TRIES.
+    """
+    bands = [range(box * b, box * (b + 1)) for b in xrange(box)]
+    band_keys = [sorted(keys[line] for line in band) for band in bands]
+    band_runs = tie_runs(xrange(box), band_keys.__getitem__)
+    line_runs = [tie_runs(band, keys.__getitem__) for band in bands]
+    n = count_orders(band_runs)
+    for runs in line_runs:
+        n *= count_orders(runs)
+    if n > CANONICAL_TRIES:
+        return [[line for b in sum(band_runs, []) for run in line_runs[b]
+                 for line in run]]
+    per_band = [list(run_orders(runs)) for runs in line_runs]
+    return [[line for lines in parts for line in lines]
+            for band_order in run_orders(band_runs)
+            for parts in product(*[per_band[b] for b in band_order])]
+
+
+def canonical_form(table):
+    """
+    The canonical form of a board (a nested list) under its symmetries:
+    relabelling the values, permuting the bands, the rows within a band,
+    the stacks and the columns within a stack, and transposing. Returns
+    the canonical board in the one line format, which is the same for
+    every variant of a board, and the (transposed, rows, columns, relabel)
+    transform that takes the board there; from_canonical undoes it.
+
+    Rows and columns are ordered by refine_keys and the values relabelled
+    in order of appearance. Ties are broken every way, and the smallest
+    result wins, unless there are too many (very symmetric or nearly empty
+    boards): those get a form that is still correct, but that some of
+    their variants do not share.
+    """
+    size = len(table)
+    box = get_shape(size).box
+    best = None
+    for transposed in (False, True):
+        board = map(list, zip(*table)) if transposed else table
+        row_keys, col_keys = refine_keys(board)
+        row_orders = line_orders(row_keys, box)
+        col_orders = line_orders(col_keys, box)
+        if len(row_orders) * len(col_orders) > CANONICAL_TRIES:
+            col_orders = col_orders[:1]
+        for rows in row_orders:
+            for cols in col_orders:
+                relabel = {}
+                chars = []
+                for r in rows:
+                    row = board[r]
+                    for c in cols:
+                        val = row[c]
+                        if val is None:
+                            chars.append('.')
+                            continue
+                        if val not in relabel:
+                            relabel[val] = len(relabel) + 1
+                        chars.append(SYMBOLS[relabel[val] - 1])
+                key = ''.join(chars)
+                if best is None or key < best[0]:
+                    best = key, (transposed, rows, cols, relabel)
+    key, (transposed, rows, cols, relabel) = best
+    # values that are not given can go to any of the labels left
+    missing = [val for val in xrange(1, size + 1) if val not in relabel]
+    for val in missing:
+        relabel[val] = len(relabel) + 1
+    return key, (transposed, rows, cols, relabel)
+
+
+def from_canonical(table, transform):
+    """
+    Map a board in canonical orientation and labels (a nested list) back
+    to the board canonical_form got the transform from.
+    """
+    transposed, rows, cols, relabel = transform
+    unlabel = dict((new, old) for old, new in relabel.iteritems())
+    size = len(table)
+    ans = [[None] * size for i in xrange(size)]
+    for i, r in enumerate(rows):
+        for j, c in enumerate(cols):
+            val = table[i][j]
+            ans[r][c] = None if val is None else unlabel[val]
+    return map(list, zip(*ans)) if transposed else ans
+
+
+CacheInfo = namedtuple('CacheInfo', 'hits disk_hits misses maxsize currsize')
+
+
+class SolutionCache(object):
+    """
+    Solutions by the canonical form of their puzzle, so that a puzzle seen
+    before, in any relabelling, permutation or transpose, is not solved
+    again. The maxsize most recently used are kept in memory; with a path,
+    all of them also go into a shelve file there and outlive the process.
+    Puzzles without a solution are remembered too.
+    """
+
+    def __init__(self, maxsize=1024, path=None, engine='table'):
+        self.maxsize = maxsize
+        self.engine = engine
+        self.memory = OrderedDict()
+        self.disk = None if path is None else shelve.open(path)
+        self.hits = self.disk_hits = self.misses = 0
+
+    def solve(self, table):
+        """
+        Like solve_puzzle, but from the cache when it can.
+        """
+        table = as_table(table)
+        key, transform = canonical_form(table)
+        found, solution = self.get(key)
+        if not found:
+            solution = solve_puzzle(key, self.engine)
+            if solution is not None:
+                solution = format_puzzle(solution)
+            self.put(key, solution)
+        if solution is None:
+            return None
+        return from_canonical(parse_puzzle(solution), transform)
+
+    def get(self, key):
+        """
+        (found, solution in the one line format or None) for a canonical
+        form, counting it as a hit or a miss.
+        """
+        if key in self.memory:
+            # most recently used last
+            solution = self.memory[key] = self.memory.pop(key)
+            self.hits += 1
+            return True, solution
+        if self.disk is not None and key in self.disk:
+            solution = self.disk[key]
+            self.remember(key, solution)
+            self.disk_hits += 1
+            return True, solution
+        self.misses += 1
+        return False, None
+
+    def put(self, key, solution):
+        self.remember(key, solution)
+        if self.disk is not None:
+            self.disk[key] = solution
+
+    def remember(self, key, solution):
+        self.memory[key] = solution
+        if len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def info(self):
+        """
+        hits (in memory), disk_hits, misses (solved), maxsize and currsize
+        (in memory).
+        """
+        return CacheInfo(self.hits, self.disk_hits, self.misses,
+                         self.maxsize, len(self.memory))
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+
+
+def grade_puzzle(table):
+    """
+    The first of DIFFICULTIES whose techniques solve the puzzle (anything
+    as_table takes), or None if it does not have exactly one
+    solution. Each level carries on from where the one before got to.
+    """
+    table = as_table(table)
+    S = get_sudoku_table(table)
+    for difficulty in DIFFICULTIES[:-1]:
+        S.use_techniques(difficulty)
+        if not S.deduce(explain=False):
+            return None
+        if S.solved:
+            return difficulty
+    return 'search' if S.count_solutions() == 1 else None
+
+
+def empty_table(size=9):
+    return get_sudoku_table([[None] * size for i in xrange(size)])
+
+
+def random_solution(size=9, rng=random):
+    """
+    A random filled in board, as a nested list.
+    """
+    return SudokuDLX(empty_table(size).to_grid(), rng=rng).solve()
+
+
+def generate_puzzle(difficulty='singles', size=9, rng=random):
+    """
+    A puzzle with a unique solution that grades as difficulty (one of
+    DIFFICULTIES), as a nested list. It is minimal for its difficulty:
+    without any one of its clues, it would need more techniques or have
+    more than one solution. For 'search' this is the usual sense of
+    minimal, no clue can go.
+
+    Clues of a random solution go into a single table until its techniques
+    solve it, then the clues are dropped again one at a time, latest first.
+    Every test starts from the state the table was in before that clue
+    went in, rolled back with undo, so the propagation of the earlier
+    clues is not redone. What is left is solved with the techniques of the
+    level below only: fewer clues never make a puzzle easier, so if those
+    cannot solve it, none of the easier levels can, and it grades as
+    difficulty without grading it again. Otherwise another one is made.
+    """
+    # the level below, kept in the state of an empty board between tries
+    E = None
+    level = DIFFICULTIES.index(difficulty)
+    if level:
+        E = empty_table(size)
+        E.use_techniques(DIFFICULTIES[level - 1])
+        E.deduce(explain=False)
+    while True:
+        puzzle = make_puzzle(difficulty, size, rng, E)
+        if puzzle is not None:
+            return puzzle
+
+
+def make_puzzle(difficulty, size, rng, easier=None):
+    """
+    One try of generate_puzzle: the puzzle, or None if the techniques of
+    the table easier solve it.
+    """
+    solution = [val for row in random_solution(size, rng) for val in row]
+    S = empty_table(size)
+    S.use_techniques(difficulty)
+    S.deduce(explain=False)
+    mask_count = S.shape.mask_count
+    # marks[i] is where the trail was before clues[i] went in
+    clues, marks = [], []
+    order = range(len(solution))
+    rng.shuffle(order)
+    for c in order:
+        if S.solved:
+            break
+        if mask_count[S.cells[c].mask] > 1:
+            clues.append(c)
+            marks.append(len(S.trail))
+            S.cells[c].restrict_mask(1 << (solution[c] - 1))
+            S.deduce(explain=False)
+
+    kept = [True] * len(clues)
+    for i in reversed(xrange(len(clues))):
+        S.undo(marks[i])
+        for j in xrange(i + 1, len(clues)):
+            if kept[j]:
+                S.cells[clues[j]].restrict_mask(1 << (solution[clues[j]] - 1))
+        if difficulty == 'search':
+            kept[i] = S.count_solutions() != 1
+        else:
+            kept[i] = not (S.deduce(explain=False) and S.solved)
+
+    givens = set(c for c, keep in zip(clues, kept) if keep)
+    if easier is not None:
+        mark = len(easier.trail)
+        for c in givens:
+            easier.cells[c].restrict_mask(1 << (solution[c] - 1))
+        too_easy = easier.deduce(explain=False) and easier.solved
+        easier.undo(mark)
+        if too_easy:
+            return None
+    return [[solution[c] if c in givens else None
+             for c in xrange(r * size, (r + 1) * size)]
+            for r in xrange(size)]
+
+
+def generate_chunk(task):
+    n, difficulty, size, seed = task
+    rng = random.Random(seed)
+    return [generate_puzzle(difficulty, size, rng) for i in xrange(n)]
+
+
+def generate_many(n, difficulty='singles', size=9, workers=None,
+                  chunksize=16, seed=None):
+    """
+    Yield n puzzles from generate_puzzle, made by a pool of `workers`
+    processes (one per CPU by default) in chunks of `chunksize`. Each
+    chunk gets its own seed drawn from `seed`, so a given seed always
+    yields the same puzzles.
+    """
+    rng = random.Random(seed)
+    sizes = [min(chunksize, n - i) for i in xrange(0, n, chunksize)]
+    tasks = [(k, difficulty, size, rng.getrandbits(32)) for k in sizes]
+    workers = workers or cpu_count()
+    if workers == 1:
+        for task in tasks:
+            for puzzle in generate_chunk(task):
+                yield puzzle
+        return
+    pool = Pool(workers)
+    try:
+        for chunk in pool.imap(generate_chunk, tasks):
+            for puzzle in chunk:
+                yield puzzle
+    finally:
+        pool.terminate()
+
+
+def read_puzzle(table):
+    """
+    as_table, but returning the ValueError of a puzzle that cannot be read
+    rather than raising it, so one bad line does not cost a whole chunk.
+    """
+    try:
+        return as_table(table)
+    except ValueError as e:
+        return e
+
+
+def solve_chunk(tables, engine='table', deadline=None):
+    """
+    The solutions of a list of puzzles, as solve_many yields them. Those
+    not done by the deadline (a time.time()), if there is one, are
+    'deadline': puzzles are not started past it, and the table and batch
+    engines give up on a search that runs over it.
+    """
+    solutions = map(read_puzzle, tables)
+    tables = [(i, table) for i, table in enumerate(solutions)
+              if not isinstance(table, ValueError)]
+    if engine == 'batch':
+        # a SudokuBatch per board size, in the original order
+        for size in sorted(set(len(table) for i, table in tables)):
+            idx = [i for i, table in tables if len(table) == size]
+            if deadline is not None and time.time() > deadline:
+                for i in idx:
+                    solutions[i] = 'deadline'
+                continue
+            batch = SudokuBatch([solutions[i] for i in idx])
+            for i, solution in zip(idx, batch.solve(deadline)):
+                solutions[i] = solution
+        return solutions
+    for i, table in tables:
+        if deadline is not None and time.time() > deadline:
+            solutions[i] = 'deadline'
+        else:
+            solutions[i] = solve_puzzle(table, engine, deadline)
+    return solutions
+
+
+def solve_many(tables, workers=None, chunksize=64, engine='table'):
+    """
+    Solve an iterable of puzzles (anything as_table takes),
+    yielding the solutions in input order, None where there is none and
+    the ValueError where a puzzle could not be read.
+    engine is 'table' to solve them one SudokuTable at a time, 'batch' to
+    push every chunk through a SudokuBatch first, or 'dlx' for SudokuDLX.
+
+    The puzzles are handed to a pool of `workers` processes (one per CPU by
+    default) in chunks of `chunksize`. Only a couple of chunks per worker
+    are in flight at any time, so memory stays bounded however long the
+    input is.
+    """
+    tables = iter(tables)
+    chunks = iter(lambda: list(islice(tables, chunksize)), [])
+    workers = workers or cpu_count()
+    if workers == 1:
+        for chunk in chunks:
+            for solution in solve_chunk(chunk, engine):
+                yield solution
+        return
+    pool = Pool(workers)
+    try:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(solve_chunk, (chunk, engine)))
+            if len(pending) > 2 * workers:
+                for solution in pending.popleft().get():
+                    yield solution
+        while pending:
+            for solution in pending.popleft().get():
+                yield solution
+    finally:
+        pool.terminate()
+
+
+def table_from_snapshot(snapshot):
+    S = empty_table(snapshot[0])
+    S.load_snapshot(snapshot)
+    return S
+
+
+class SharedSearch(object):
+    """
+    What the processes of search_parallel share: a queue of unexplored
+    subtrees, as (snapshot, cell index, values to try there) tasks or a
+    whole table with a None cell, how many of those are queued or being
+    explored, the solutions found so far, and the event that stops
+    everyone, set once limit solutions are found or nothing is left.
+    """
+
+    def __init__(self, workers, limit=1):
+        self.workers = workers
+        self.limit = limit
+        self.tasks = Queue()
+        self.results = Queue()
+        self.pending = Value('i', 0)
+        self.found = Value('i', 0)
+        self.stop = Event()
+
+    def put(self, task):
+        with self.pending.get_lock():
+            self.pending.value += 1
+        self.tasks.put(task)
+
+    def task_done(self):
+        with self.pending.get_lock():
+            self.pending.value -= 1
+            if not self.pending.value:
+                self.stop.set()
+
+    def hungry(self):
+        """
+        Whether a worker is (or is about to be) waiting for a task, that
+        is fewer of them are queued or being explored than there are
+        workers.
+        """
+        return self.pending.value < self.workers
+
+    def add_solution(self, solution):
+        with self.found.get_lock():
+            self.found.value += 1
+            if self.found.value >= self.limit:
+                self.stop.set()
+        self.results.put(solution)
+
+
+def search_worker(shared):
+    """
+    Body of the search_parallel processes: explore tasks until the search
+    stops, on one SudokuTable loaded from their snapshots.
+    """
+    S = None
+    while not shared.stop.is_set():
+        try:
+            task = shared.tasks.get(timeout=0.05)
+        except Empty:
+            continue
+        snapshot = task[0]
+        if S is None or S.shape.size != snapshot[0]:
+            S = table_from_snapshot(snapshot)
+        else:
+            S.load_snapshot(snapshot)
+        try:
+            explore(S, task, shared)
+        finally:
+            shared.task_done()
+
+
+def explore(S, task, shared):
+    """
+    Depth first search of one task, the same as SudokuTable.search but
+    with the guesses on a stack of [cell index, values left, trail mark]
+    frames instead of the call stack. Whenever another worker runs out of
+    tasks, the values left at the shallowest guess, the biggest subtrees
+    there are, go to the shared queue for it to take, with a snapshot of
+    the table at that guess made from the trail. The value about to be
+    tried is taken off first, so a worker never gives away all its work:
+    with more workers than open guesses, they would only pass the same
+    tasks around.
+    """
+    snapshot, index, vals = task
+    stack = []
+    if index is None:
+        if not S.deduce(explain=False):
+            return
+        if S.solved:
+            shared.add_solution(S.to_grid())
+            return
+        cell, vals = S.pick_cell()
+        index = S.cells.index(cell)
+    stack.append([index, list(vals), len(S.trail)])
+    while stack and not shared.stop.is_set():
+        index, vals, mark = stack[-1]
+        S.undo(mark)
+        if not vals:
+            stack.pop()
+            continue
+        val = vals.pop(0)
+        if shared.hungry():
+            for frame in stack:
+                if frame[1]:
+                    snapshot = S.snapshot(frame[2])
+                    for other in frame[1]:
+                        shared.put((snapshot, frame[0], (other,)))
+                    del frame[1][:]
+                    break
+        S.nodes += 1
+        S.cells[index].restrict_mask(1 << (val - 1))
+        if not S.deduce(explain=False):
+            continue
+        if S.solved:
+            shared.add_solution(S.to_grid())
+            continue
+        cell, vals = S.pick_cell()
+        stack.append([S.cells.index(cell), list(vals), len(S.trail)])
+
+
+def search_parallel(table, workers=None, limit=1):
+    """
+    Solve one hard puzzle (anything as_table takes) by splitting its
+    search tree between `workers` processes (one per CPU by default),
+    rather than giving each process puzzles of its own. Workers that run
+    out of work take unexplored subtrees from the others, see explore.
+    Returns up to limit solutions as nested lists, stopping as soon as
+    that many are found: the default finds any one, limit=2 tells unique
+    puzzles from others like count_solutions. Raises RuntimeError if a
+    worker process dies before the search is over, as what it was
+    exploring is lost.
+    """
+    S = get_sudoku_table(as_table(table))
+    if not S.deduce(explain=False):
+        return []
+    if S.solved:
+        return [S.to_grid()]
+    workers = workers or cpu_count()
+    shared = SharedSearch(workers, limit)
+    shared.put((S.snapshot(), None, None))
+    processes = []
+    if workers == 1:
+        search_worker(shared)
+    else:
+        processes = [Process(target=search_worker, args=(shared,))
+                     for i in xrange(workers)]
+        for process in processes:
+            process.daemon = True
+            process.start()
+    try:
+        # workers only return once stop is set
+        while not shared.stop.wait(0.1):
+            if any([process.exitcode is not None
+                    for process in processes]) and \
+                    not shared.stop.is_set():
+                raise RuntimeError('a search_parallel worker died')
+        # every one counted in found is on its way, possibly past limit
+        solutions = [shared.results.get()
+                     for i in xrange(shared.found.value)]
+        return solutions[:limit]
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Solve puzzles given one per line (81 characters for '
+                    '9x9, 256 for 16x16...), printing one solution per '
+                    'line.')
+    parser.add_argument('puzzles', nargs='?', type=argparse.FileType('r'),
+                        default=sys.stdin,
+                        help='file to read the puzzles from (default: stdin)')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of processes (default: one per CPU)')
+    parser.add_argument('-c', '--chunksize', type=int, default=64,
+                        help='puzzles handed to a process at a time')
+    parser.add_argument('-e', '--engine', choices=['table', 'batch', 'dlx'],
+                        default='table',
+                        help='solve one SudokuTable at a time, propagate '
+                             'each chunk as a SudokuBatch first, or use '
+                             'dancing links')
+    parser.add_argument('--cache', metavar='FILE',
+                        help='look the puzzles up in (and add them to) a '
+                             'solution cache kept in FILE, solving in this '
+                             'process; the hit counts go to stderr')
+    parser.add_argument('--split-search', action='store_true',
+                        help='solve one puzzle at a time, splitting its '
+                             'search between the workers, for a few very '
+                             'hard puzzles rather than many')
+    parser.add_argument('--grade', action='store_true',
+                        help='print the difficulty of each puzzle instead '
+                             '(one of %s, or unsolvable)' %
+                             ', '.join(DIFFICULTIES))
+    parser.add_argument('-g', '--generate', type=int, metavar='N',
+                        help='print N new puzzles instead of reading any')
+    parser.add_argument('-d', '--difficulty', choices=DIFFICULTIES,
+                        default='singles',
+                        help='of the generated puzzles')
+    parser.add_argument('-s', '--size', type=int, default=9,
+                        help='of the generated puzzles')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='for the generator')
+    args = parser.parse_args(argv)
+    if args.generate:
+        for puzzle in generate_many(args.generate, args.difficulty,
+                                    args.size, args.workers, seed=args.seed):
+            sys.stdout.write(format_puzzle(puzzle) + '\n')
+        return
+    lines = (line.strip() for line in args.puzzles)
+    lines = (line for line in lines if line and not line.startswith('#'))
+    if args.grade:
+        for line in lines:
+            sys.stdout.write((grade_puzzle(line) or 'unsolvable') + '\n')
+        return
+    # read here, the pool reads the lines in the workers
+    tables = (read_puzzle(line) for line in lines)
+    if args.cache:
+        cache = SolutionCache(path=args.cache, engine=args.engine)
+        solutions = (table if isinstance(table, ValueError) else
+                     cache.solve(table) for table in tables)
+    elif args.split_search:
+        cache = None
+        solutions = (table if isinstance(table, ValueError) else
+                     (search_parallel(table, args.workers) or [None])[0]
+                     for table in tables)
+    else:
+        cache = None
+        solutions = solve_many(lines, args.workers, args.chunksize,
+                               args.engine)
+    try:
+        for solution in solutions:
+            if isinstance(solution, ValueError):
+                sys.stdout.write('error: %s\n' % solution)
+            elif solution is None:
+                sys.stdout.write('unsolvable\n')
+            else:
+                sys.stdout.write(format_puzzle(solution) + '\n')
+    finally:
+        if cache is not None:
+            sys.stderr.write('%s\n' % (cache.info(),))
+            cache.close()
+
+
+if __name__ == '__main__' and len(sys.argv) > 1:
+    sys.exit(main())
+elif __name__ == '__main__':
     easy = [
         [None, None, 5, None, None, 3, 1, 4, None],
         [None, 7, None, None, 2, None, None, None, 5],
@@ -443,7 +2773,8 @@ if __name__ == '__main__':
         [5, None, None, 9, 3, None, None, None, 2],
         [4, 2, 3, 1, None, 5, None, 6, 9],
     ]
-    # XXX: Our current tools are not sufficient to solve the following
+    # Subsets and relating the groups are not sufficient for the following,
+    # it took trial/error on top of them until coloring came along
     extreme5 = [
         [9, 8, None, 3, 7, 5, 1, None, 2],
         [2, 7, None, None, None, 8, 5, 3, None],
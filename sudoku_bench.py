@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+"""
+Benchmarks for sudoku.py.
+
+Runs every engine (and, for the SudokuTable engine, every technique set)
+over the tiered corpus in sudoku_puzzles/ and reports puzzles per second,
+latency percentiles, search nodes and peak memory. Each case runs in a
+fresh process so the memory numbers do not leak into each other. Results
+can be saved as JSON and compared against an earlier run to catch
+regressions between versions. Everything runs offline.
+"""
+
+
+from multiprocessing import Pipe, Process
+from timeit import default_timer
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import sudoku
+
+
+__author__ = 'taylanbil'
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(HERE, 'sudoku_puzzles')
+TIERS = ['easy', 'medium', 'hard', 'extreme', 'pathological', 'unsolvable',
+         'large']
+
+# name: (subset sizes for fit/spot, whether relate_groups runs, extra
+# techniques); None for the defaults of the board, (1, 2, 3) and all of
+# sudoku.CHAINS on 9x9
+TECHNIQUE_SETS = {
+    'singles': ((1,), False, ()),
+    'singles+relate': ((1,), True, ()),
+    'subsets': (None, False, ()),
+    'subsets+relate': (None, True, ()),
+    'full': (None, True, None),
+}
+
+
+def load_tier(tier, variants=1, seed=0):
+    """
+    The puzzles of a tier, each followed by variants - 1 random relabelled
+    and permuted copies of it (same difficulty, different grid).
+    """
+    rng = random.Random(seed)
+    puzzles = []
+    with open(os.path.join(CORPUS_DIR, tier + '.txt')) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            puzzles.append(line)
+            for i in xrange(variants - 1):
+                puzzles.append(shuffle_puzzle(line, rng))
+    return puzzles
+
+
+def shuffle_puzzle(puzzle, rng):
+    """
+    Apply a random symmetry to a puzzle: relabel the digits, permute the
+    bands and the rows within them, the stacks and the columns within them,
+    and maybe transpose.
+    """
+    shape = sudoku.get_shape(int(round(len(puzzle) ** 0.5)))
+    size, box = shape.size, shape.box
+    symbols = sudoku.SYMBOLS[:size]
+    digits = list(symbols)
+    rng.shuffle(digits)
+    relabel = dict(zip(symbols, digits))
+
+    def lines():
+        bands = rng.sample(xrange(box), box)
+        return [box * band + i for band in bands
+                for i in rng.sample(xrange(box), box)]
+
+    rows, cols = lines(), lines()
+    transpose = rng.random() < 0.5
+    ans = []
+    for r in rows:
+        for c in cols:
+            char = (puzzle[size * c + r] if transpose else
+                    puzzle[size * r + c])
+            ans.append(relabel.get(char, '.'))
+    return ''.join(ans)
+
+
+def check_solution(puzzle, solution):
+    values = [val for row in solution for val in row]
+    givens = [val for row in sudoku.parse_puzzle(puzzle) for val in row]
+    if any(given is not None and given != val
+           for given, val in zip(givens, values)):
+        return False
+    shape = sudoku.get_shape(len(solution))
+    return all(sorted(values[c] for c in unit) == range(1, shape.size + 1)
+               for unit in shape.units)
+
+
+def run_table(puzzles, techniques, stats=None):
+    subset_sizes, relating, extra_techniques = TECHNIQUE_SETS[techniques]
+    solutions, latencies, nodes = [], [], 0
+    for puzzle in puzzles:
+        start = default_timer()
+        S = sudoku.get_sudoku_table(sudoku.parse_puzzle(puzzle))
+        S.subset_sizes = subset_sizes or S.subset_sizes
+        S.relating = relating
+        if extra_techniques is not None:
+            S.extra_techniques = extra_techniques
+        if stats is not None:
+            S.enable_stats()
+        if S.deduce(explain=False) and (S.solved or S.search(explain=False)):
+            solutions.append(S.to_grid())
+        else:
+            solutions.append(None)
+        latencies.append(default_timer() - start)
+        nodes += S.nodes
+        if stats is not None:
+            add_stats(stats, S.stats)
+    return solutions, latencies, nodes
+
+
+def add_stats(totals, stats):
+    for (technique, n), technique_stats in stats.iteritems():
+        name = technique if n is None else '%s/%s' % (technique, n)
+        total = totals.setdefault(name, dict.fromkeys(
+            sudoku.TechniqueStats.__slots__, 0))
+        for field in sudoku.TechniqueStats.__slots__:
+            total[field] += getattr(technique_stats, field)
+
+
+def run_batch(puzzles, techniques, stats=None):
+    # one batch per board size, the candidate tensors cannot mix them
+    solutions, nodes = [None] * len(puzzles), 0
+    for length in sorted(set(len(puzzle) for puzzle in puzzles)):
+        idx = [i for i, puzzle in enumerate(puzzles)
+               if len(puzzle) == length]
+        B = sudoku.SudokuBatch([puzzles[i] for i in idx])
+        for i, solution in zip(idx, B.solve()):
+            solutions[i] = solution
+        nodes += B.nodes
+    return solutions, None, nodes
+
+
+def run_dlx(puzzles, techniques, stats=None):
+    solutions, latencies, nodes = [], [], 0
+    for puzzle in puzzles:
+        start = default_timer()
+        dlx = sudoku.SudokuDLX(sudoku.parse_puzzle(puzzle))
+        solutions.append(dlx.solve())
+        latencies.append(default_timer() - start)
+        nodes += dlx.nodes
+    return solutions, latencies, nodes
+
+
+# More than the values tried at the first guess of the corpus puzzles, so
+# that some workers of split always start out with nothing to do.
+SPLIT_WORKERS = 8
+
+
+def run_split(puzzles, techniques, stats=None):
+    solutions, latencies = [], []
+    for puzzle in puzzles:
+        start = default_timer()
+        found = sudoku.search_parallel(puzzle, SPLIT_WORKERS)
+        solutions.append(found[0] if found else None)
+        latencies.append(default_timer() - start)
+    return solutions, latencies, 0
+
+
+# name: (runner, whether it takes the technique sets)
+ENGINES = {
+    'table': (run_table, True),
+    'batch': (run_batch, False),
+    'dlx': (run_dlx, False),
+    'split': (run_split, False),
+}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+
+def run_case(engine, techniques, tier, puzzles, stats=False):
+    """
+    Solve the puzzles with one engine and technique set, and measure it.
+    With stats, also collect the per technique counters of the engines
+    that have them (which slows those down).
+    """
+    runner, _ = ENGINES[engine]
+    technique_stats = {} if stats else None
+    start = default_timer()
+    solutions, latencies, nodes = runner(puzzles, techniques,
+                                         technique_stats)
+    elapsed = default_timer() - start
+    errors = 0
+    for puzzle, solution in zip(puzzles, solutions):
+        if tier == 'unsolvable':
+            errors += solution is not None
+        else:
+            errors += solution is None or not check_solution(puzzle, solution)
+    result = {
+        'engine': engine,
+        'techniques': techniques,
+        'tier': tier,
+        'puzzles': len(puzzles),
+        'seconds': elapsed,
+        'puzzles_per_second': len(puzzles) / elapsed if elapsed else None,
+        'nodes': nodes,
+        'errors': errors,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'technique_stats': technique_stats,
+    }
+    for p in (50, 90, 99, 100):
+        result['p%s_ms' % p] = (None if latencies is None else
+                                1000 * percentile(latencies, p))
+    return result
+
+
+def send_case(conn, args):
+    try:
+        conn.send(run_case(*args))
+    except Exception as e:
+        conn.send(e)
+    finally:
+        conn.close()
+
+
+def run_isolated(args):
+    """
+    run_case in a process of its own, so peak_kb is this case's alone. It
+    is not a pool worker, as those cannot start the processes of split.
+    """
+    receiver, sender = Pipe(False)
+    process = Process(target=send_case, args=(sender, args))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    finally:
+        process.join()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def git_version():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'describe', '--always', '--dirty'], cwd=HERE,
+                stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def key(result):
+    return result['engine'], result['techniques'], result['tier']
+
+
+def format_result(result):
+    def ms(val):
+        return '-' if val is None else '%.2f' % val
+    return ('%-6s %-15s %-13s %5d %10.1f %8s %8s %8s %8s %7d %8.1f %6d' % (
+        result['engine'], result['techniques'], result['tier'],
+        result['puzzles'], result['puzzles_per_second'] or 0,
+        ms(result['p50_ms']), ms(result['p90_ms']), ms(result['p99_ms']),
+        ms(result['p100_ms']), result['nodes'], result['peak_kb'] / 1024.0,
+        result['errors']))
+
+
+def format_technique_stats(technique_stats):
+    lines = []
+    for name in sorted(technique_stats):
+        stats = technique_stats[name]
+        lines.append('    %-10s calls %7d  tried %9d  fired %7d  '
+                     'eliminated %7d  %9.2f ms' % (
+                         name, stats['calls'], stats['tried'], stats['fired'],
+                         stats['eliminated'], 1000 * stats['seconds']))
+    return '\n'.join(lines)
+
+
+HEADER = ('%-6s %-15s %-13s %5s %10s %8s %8s %8s %8s %7s %8s %6s' % (
+    'engine', 'techniques', 'tier', 'n', 'puzzles/s', 'p50 ms', 'p90 ms',
+    'p99 ms', 'max ms', 'nodes', 'peak MB', 'errors'))
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the throughput of results relative to a saved baseline run, and
+    return the cases that got slower by more than tolerance.
+    """
+    old = dict((key(result), result) for result in baseline['results'])
+    regressions = []
+    print('\nCompared to %s (%s):' % (baseline.get('version'),
+                                      baseline.get('time')))
+    for result in results:
+        before = old.get(key(result))
+        if not before or not before['puzzles_per_second']:
+            continue
+        ratio = result['puzzles_per_second'] / before['puzzles_per_second']
+        flag = ''
+        if ratio < 1 - tolerance:
+            flag = '  REGRESSION'
+            regressions.append(result)
+        elif result['errors'] > before['errors']:
+            flag = '  NEW ERRORS'
+            regressions.append(result)
+        print('%-6s %-15s %-13s %6.2fx%s' % (key(result) + (ratio, flag)))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-e', '--engines', nargs='+', choices=sorted(ENGINES),
+                        default=sorted(ENGINES))
+    parser.add_argument('-t', '--techniques', nargs='+',
+                        choices=sorted(TECHNIQUE_SETS), default=['full'],
+                        help='technique sets for the engines that take them')
+    parser.add_argument('--tiers', nargs='+', choices=TIERS, default=TIERS)
+    parser.add_argument('-v', '--variants', type=int, default=1,
+                        help='solve this many shuffled copies of each puzzle')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--in-process', action='store_true',
+                        help='do not isolate cases in their own processes '
+                             '(peak memory then accumulates)')
+    parser.add_argument('--stats', action='store_true',
+                        help='also report per technique counters and times')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of an earlier --save')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='slowdown that counts as a regression')
+    args = parser.parse_args(argv)
+
+    run = run_case if args.in_process else lambda *a: run_isolated(a)
+    results = []
+    print(HEADER)
+    for tier in args.tiers:
+        puzzles = load_tier(tier, args.variants, args.seed)
+        for engine in args.engines:
+            technique_sets = args.techniques if ENGINES[engine][1] else ['-']
+            for techniques in technique_sets:
+                result = run(engine, techniques, tier, puzzles, args.stats)
+                results.append(result)
+                print(format_result(result))
+                if result['technique_stats']:
+                    print(format_technique_stats(result['technique_stats']))
+                sys.stdout.flush()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'version': git_version(),
+                       'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'python': platform.python_version(),
+                       'variants': args.variants,
+                       'seed': args.seed,
+                       'results': results}, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
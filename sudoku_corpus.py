@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+"""
+Binary puzzle corpora: fixed size records, read through a memory map.
+
+A corpus file is a 16 byte header followed by one record per puzzle. The
+header is the magic 'SDKB', the format version, the box width of the
+boards (3 for 9x9), the flags of the optional fields, a reserved byte and
+the number of records as a little endian 64 bit integer. A record is
+
+    puzzle      n_cells bytes, row by row, 0 for an empty cell
+    solution    n_cells bytes, all 0 if there is none (FLAG_SOLUTIONS)
+    difficulty  1 byte: 0 if not graded, i + 1 for GRADES[i] and 255 for
+                no unique solution (FLAG_DIFFICULTIES)
+
+so a 9x9 corpus of bare puzzles takes 81 bytes a puzzle. Corpus hands out
+uint8 views straight into the mapped file, which SudokuBatch and
+sudoku.as_table take as they are; nothing is parsed into Python objects
+until a puzzle is solved, however big the file.
+"""
+
+
+from multiprocessing import Pool, cpu_count
+import argparse
+import struct
+import sys
+
+import numpy as np
+
+import sudoku
+
+
+__author__ = 'taylanbil'
+
+
+MAGIC = 'SDKB'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBBQ')
+FLAG_SOLUTIONS = 1
+FLAG_DIFFICULTIES = 2
+UNGRADED, NOT_UNIQUE = 0, 255
+# The difficulty codes, in the order the levels were added to
+# sudoku.DIFFICULTIES rather than by difficulty, so that they never change.
+GRADES = ['singles', 'relate', 'pairs', 'triples', 'search', 'fish', 'chains']
+
+
+def record_dtype(size, flags):
+    fields = [('puzzle', np.uint8, (size * size,))]
+    if flags & FLAG_SOLUTIONS:
+        fields.append(('solution', np.uint8, (size * size,)))
+    if flags & FLAG_DIFFICULTIES:
+        fields.append(('difficulty', np.uint8))
+    return np.dtype(fields)
+
+
+def encode(lines, size=9):
+    """
+    One line puzzles (or solutions) as an (N, n_cells) uint8 array, all at
+    once rather than character by character.
+    """
+    n_cells = size * size
+    lines = [line.strip() for line in lines]
+    bad = [line for line in lines if len(line) != n_cells]
+    if bad:
+        raise ValueError('Expected %s characters, got %s: %r' %
+                         (n_cells, len(bad[0]), bad[0]))
+    codes = np.empty(256, np.uint8)
+    codes.fill(255)
+    codes[[ord('.'), ord('0')]] = 0
+    for val, char in enumerate(sudoku.SYMBOLS[:size], 1):
+        codes[[ord(char), ord(char.lower())]] = val
+    ans = codes[np.frombuffer(''.join(lines), np.uint8)]
+    if (ans == 255).any():
+        line = lines[int(np.flatnonzero(ans == 255)[0]) // n_cells]
+        raise ValueError('Unexpected character in %r' % line)
+    return ans.reshape(len(lines), n_cells)
+
+
+def decode(array):
+    """
+    The one line strings of an (N, n_cells) integer array.
+    """
+    chars = np.frombuffer('.' + sudoku.SYMBOLS, np.uint8)
+    array = np.asarray(array)
+    if not array.size:
+        return []
+    return chars[array].view('S%s' % array.shape[-1]).ravel().tolist()
+
+
+class Corpus(object):
+    """
+    A corpus file, memory mapped read only. puzzles is an (N, n_cells)
+    uint8 view of the puzzles, solutions and difficulties the same for the
+    optional fields (None if the file does not have them).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size or header[:4] != MAGIC:
+            raise ValueError('%s is not a puzzle corpus' % path)
+        magic, version, box, self.flags, reserved, count = \
+            HEADER.unpack(header)
+        if version != VERSION:
+            raise ValueError('%s is version %s, not %s' %
+                             (path, version, VERSION))
+        self.size = box * box
+        dtype = record_dtype(self.size, self.flags)
+        if count:
+            self.records = np.memmap(path, dtype, 'r', HEADER.size, (count,))
+        else:
+            # an empty file cannot be mapped
+            self.records = np.zeros(0, dtype)
+        self.puzzles = self.records['puzzle']
+        self.solutions = (self.records['solution']
+                          if self.flags & FLAG_SOLUTIONS else None)
+        self.difficulties = (self.records['difficulty']
+                             if self.flags & FLAG_DIFFICULTIES else None)
+
+    def __len__(self):
+        return len(self.records)
+
+    def lines(self, start=0, stop=None, chunksize=4096, field='puzzle'):
+        """
+        Yield the puzzles (or solutions) as one line strings.
+        """
+        stop = len(self) if stop is None else stop
+        for i in xrange(start, stop, chunksize):
+            for line in decode(self.records[field][i:min(i + chunksize,
+                                                         stop)]):
+                yield line
+
+
+class CorpusWriter(object):
+    """
+    Writes a corpus file chunk by chunk. The record count in the header is
+    filled in by close.
+    """
+
+    def __init__(self, path, size=9, solutions=False, difficulties=False):
+        self.size = size
+        self.flags = ((FLAG_SOLUTIONS if solutions else 0) |
+                      (FLAG_DIFFICULTIES if difficulties else 0))
+        self.dtype = record_dtype(size, self.flags)
+        self.count = 0
+        self.f = open(path, 'wb')
+        self.f.write(self.header())
+
+    def header(self):
+        return HEADER.pack(MAGIC, VERSION, sudoku.get_shape(self.size).box,
+                           self.flags, 0, self.count)
+
+    def write(self, puzzles, solutions=None, difficulties=None):
+        """
+        Append records. puzzles and solutions are (N, n_cells) integer
+        arrays or lists of one line strings, difficulties N codes.
+        """
+        if not isinstance(puzzles, np.ndarray):
+            puzzles = encode(puzzles, self.size)
+        records = np.zeros(len(puzzles), self.dtype)
+        records['puzzle'] = puzzles.reshape(len(puzzles), -1)
+        if solutions is not None:
+            if not isinstance(solutions, np.ndarray):
+                solutions = encode(solutions, self.size)
+            records['solution'] = solutions.reshape(len(solutions), -1)
+        if difficulties is not None:
+            records['difficulty'] = difficulties
+        self.f.write(records.tostring())
+        self.count += len(records)
+
+    def close(self):
+        if self.f is not None:
+            self.f.seek(0)
+            self.f.write(self.header())
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def pack(lines, path, chunksize=4096):
+    """
+    Write the one line puzzles of an iterable of lines (comments and blank
+    lines are skipped) to a corpus file. Returns how many there were.
+    """
+    lines = (line.strip() for line in lines)
+    lines = (line for line in lines if line and not line.startswith('#'))
+    writer = None
+    try:
+        chunk = []
+        for line in lines:
+            if writer is None:
+                writer = CorpusWriter(path, int(round(len(line) ** 0.5)))
+            chunk.append(line)
+            if len(chunk) == chunksize:
+                writer.write(chunk)
+                chunk = []
+        if writer is None:
+            writer = CorpusWriter(path)
+        if chunk:
+            writer.write(chunk)
+        return writer.count
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+# Corpus of each path opened in this process, for the pool workers.
+CORPORA = {}
+
+
+def solve_records(task):
+    """
+    Solve records start to stop of a corpus, mapping it in this process.
+    Returns the solutions as an array, 0s where there is none, and the
+    difficulty codes if grading.
+    """
+    path, start, stop, engine, grade = task
+    corpus = CORPORA.get(path)
+    if corpus is None:
+        corpus = CORPORA[path] = Corpus(path)
+    puzzles = corpus.puzzles[start:stop]
+    solutions = np.zeros(puzzles.shape, np.uint8)
+    difficulties = None
+    if grade:
+        difficulties = np.empty(len(puzzles), np.uint8)
+        for i, puzzle in enumerate(puzzles):
+            difficulty = sudoku.grade_puzzle(puzzle)
+            difficulties[i] = (NOT_UNIQUE if difficulty is None else
+                               GRADES.index(difficulty) + 1)
+    if engine == 'batch':
+        found = sudoku.SudokuBatch(puzzles).solve()
+    else:
+        found = [sudoku.solve_puzzle(puzzle, engine) for puzzle in puzzles]
+    for i, solution in enumerate(found):
+        if solution is not None:
+            solutions[i] = np.ravel(solution)
+    return solutions, difficulties
+
+
+def solve_corpus(path, out_path, engine='table', grade=False, workers=None,
+                 chunksize=256):
+    """
+    Solve (and grade) every puzzle of a corpus into a new one with the
+    solutions (and difficulties). Worker processes map the input file
+    themselves, so only record ranges and results go between processes.
+    """
+    corpus = Corpus(path)
+    tasks = [(path, i, min(i + chunksize, len(corpus)), engine, grade)
+             for i in xrange(0, len(corpus), chunksize)]
+    workers = workers or cpu_count()
+    pool = Pool(workers) if workers > 1 else None
+    results = (pool.imap(solve_records, tasks) if pool is not None else
+               (solve_records(task) for task in tasks))
+    try:
+        with CorpusWriter(out_path, corpus.size, True, grade) as writer:
+            for task, (solutions, difficulties) in zip(tasks, results):
+                writer.write(corpus.puzzles[task[1]:task[2]], solutions,
+                             difficulties)
+            return writer.count
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+    pack_parser = commands.add_parser(
+        'pack', help='convert one line puzzles to a corpus file')
+    pack_parser.add_argument('text', type=argparse.FileType('r'))
+    pack_parser.add_argument('corpus')
+    unpack_parser = commands.add_parser(
+        'unpack', help='print the puzzles of a corpus, one per line')
+    unpack_parser.add_argument('corpus')
+    unpack_parser.add_argument('--solutions', action='store_true',
+                               help='print the solutions instead')
+    solve_parser = commands.add_parser(
+        'solve', help='write a corpus with the solutions of another')
+    solve_parser.add_argument('corpus')
+    solve_parser.add_argument('out')
+    solve_parser.add_argument('-e', '--engine',
+                              choices=['table', 'batch', 'dlx'],
+                              default='table')
+    solve_parser.add_argument('--grade', action='store_true',
+                              help='also store the difficulties')
+    solve_parser.add_argument('-w', '--workers', type=int, default=None,
+                              help='number of processes (default: one per '
+                                   'CPU)')
+    solve_parser.add_argument('-c', '--chunksize', type=int, default=256)
+    info_parser = commands.add_parser('info', help='describe a corpus')
+    info_parser.add_argument('corpus')
+    args = parser.parse_args(argv)
+
+    if args.command == 'pack':
+        count = pack(args.text, args.corpus)
+        sys.stderr.write('%s puzzles\n' % count)
+    elif args.command == 'unpack':
+        corpus = Corpus(args.corpus)
+        if args.solutions and corpus.solutions is None:
+            parser.error('%s has no solutions' % args.corpus)
+        for line in corpus.lines(
+                field='solution' if args.solutions else 'puzzle'):
+            # a solution of all 0s is none, a puzzle of them an empty board
+            if args.solutions and not line.strip('.'):
+                line = 'unsolvable'
+            sys.stdout.write(line + '\n')
+    elif args.command == 'solve':
+        solve_corpus(args.corpus, args.out, args.engine, args.grade,
+                     args.workers, args.chunksize)
+    else:
+        corpus = Corpus(args.corpus)
+        print('%s: %s puzzles of %sx%s, %s bytes each%s%s' % (
+            args.corpus, len(corpus), corpus.size, corpus.size,
+            corpus.records.dtype.itemsize,
+            ', with solutions' if corpus.solutions is not None else '',
+            ', with difficulties' if corpus.difficulties is not None
+            else ''))
+        if corpus.difficulties is not None:
+            counts = np.bincount(corpus.difficulties, minlength=256)
+            codes = dict((name, i) for i, name in enumerate(GRADES, 1))
+            codes['ungraded'], codes['not unique'] = UNGRADED, NOT_UNIQUE
+            for name in ['ungraded'] + sudoku.DIFFICULTIES + ['not unique']:
+                if counts[codes[name]]:
+                    print('  %-10s %s' % (name, counts[codes[name]]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
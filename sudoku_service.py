@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+"""
+A long lived local sudoku solving service.
+
+Serves a line protocol on a Unix socket or a localhost TCP port: send one
+puzzle per line (in the format of sudoku.py), get one line back for each,
+in order: the solution, 'unsolvable', 'timeout', 'busy' or 'error: ...'.
+The line 'stats' gets the request counts and latency percentiles as JSON.
+
+Connections are served by threads, which queue their puzzles for a
+dispatcher. The dispatcher gathers them into batches and hands those to a
+pool of worker processes that stay up between requests, so neither the
+start up of sudoku.py nor a process per request is paid again. The queue
+is bounded: when it is full, a connection stops reading (so its client
+blocks writing) for up to the timeout, then answers 'busy'.
+"""
+
+
+from collections import deque
+from multiprocessing import Pool, cpu_count
+from timeit import default_timer
+import Queue
+import SocketServer
+import argparse
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+import sudoku
+
+
+__author__ = 'taylanbil'
+
+
+WARM_UP_PUZZLE = ('..5..314..7..2...5..2..1...2...3..5.96.....28.5..7...3'
+                  '...3..6..4...5..8..814..5..')
+
+
+def warm_up():
+    """
+    Pool initializer: solve one puzzle so the first batch is not slower,
+    and leave interrupts to the server process.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sudoku.solve_puzzle(WARM_UP_PUZZLE)
+
+
+def answer_chunk(tables, engine, deadline):
+    """
+    Solve a batch in a worker, and format the answers there. Nothing is
+    raised back: an error becomes the answer of every puzzle in the batch,
+    as the pool would not call back at all, and the batch's slot would
+    never be released.
+    """
+    try:
+        solutions = sudoku.solve_chunk(tables, engine, deadline)
+    except Exception as e:
+        return ['error: %s' % e] * len(tables)
+    return ['unsolvable' if solution is None else
+            'timeout' if solution == 'deadline' else
+            sudoku.format_puzzle(solution) for solution in solutions]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+
+class Request(object):
+    __slots__ = ('table', 'start', 'done', 'answer')
+
+    def __init__(self, table):
+        self.table = table
+        self.start = default_timer()
+        self.done = threading.Event()
+        self.answer = None
+
+    def finish(self, answer):
+        self.answer = answer
+        self.done.set()
+
+
+class Metrics(object):
+    """
+    Counts of what came of the requests, and the latencies (from queueing
+    to answer) of the last `window` answered ones.
+    """
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(
+            ['solved', 'unsolvable', 'timeout', 'busy', 'error', 'batches',
+             'batched'], 0)
+        self.latencies = deque(maxlen=window)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] += n
+
+    def answered(self, name, latency):
+        with self.lock:
+            self.counts[name] += 1
+            self.latencies.append(latency)
+
+    def report(self):
+        with self.lock:
+            report = dict(self.counts)
+            latencies = list(self.latencies)
+        report['mean_batch'] = (float(report['batched']) / report['batches']
+                                if report['batches'] else None)
+        for p in (50, 90, 99, 100):
+            report['p%s_ms' % p] = (1000 * percentile(latencies, p)
+                                    if latencies else None)
+        return report
+
+
+class Dispatcher(object):
+    """
+    Takes puzzles from any number of threads, and solves them in batches
+    of up to batch_size on a pool of worker processes. A batch goes out
+    once it is full or batch_wait seconds after its first puzzle came in,
+    and at most two batches per worker are out at a time. Each puzzle gets
+    timeout seconds, queueing included; those past it by the time their
+    batch goes out are left out of it, and a worker gives up on a batch
+    once the last puzzle of it is past it, so a hard puzzle cannot hold on
+    to the worker for good. SudokuDLX has no budget, so with engine='dlx'
+    only the puzzles not started yet are given up.
+    """
+
+    def __init__(self, workers=None, batch_size=32, batch_wait=0.002,
+                 max_pending=1024, timeout=10.0, engine='table'):
+        workers = workers or cpu_count()
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.timeout = timeout
+        self.engine = engine
+        self.queue = Queue.Queue(max_pending)
+        self.slots = threading.Semaphore(2 * workers)
+        self.metrics = Metrics()
+        self.pool = Pool(workers, initializer=warm_up)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, line):
+        """
+        Queue a puzzle in the one line format, waiting at most the timeout
+        for room. Returns the Request to wait on, or the answer
+        if there is one already ('busy' or 'error: ...').
+        """
+        try:
+            request = Request(sudoku.parse_puzzle(line))
+        except ValueError as e:
+            self.metrics.count('error')
+            return 'error: %s' % e
+        try:
+            self.queue.put(request, timeout=self.timeout)
+        except Queue.Full:
+            self.metrics.count('busy')
+            return 'busy'
+        return request
+
+    def wait(self, request):
+        """
+        The answer to a submitted request, or 'timeout' if it is not there
+        in time.
+        """
+        if not request.done.wait(
+                max(0, request.start + self.timeout - default_timer())):
+            self.metrics.count('timeout')
+            return 'timeout'
+        answer = request.answer
+        if answer in ('unsolvable', 'timeout'):
+            name = answer
+        else:
+            name = 'error' if answer.startswith('error: ') else 'solved'
+        self.metrics.answered(name, default_timer() - request.start)
+        return answer
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            if batch[0] is None:
+                return
+            deadline = default_timer() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    request = self.queue.get(
+                        timeout=max(0, deadline - default_timer()))
+                except Queue.Empty:
+                    break
+                if request is None:
+                    self.queue.put(None)
+                    break
+                batch.append(request)
+            self.slots.acquire()
+            # whoever waits on the expired ones has answered 'timeout'
+            expired = default_timer() - self.timeout
+            batch = [request for request in batch if request.start > expired]
+            if not batch:
+                self.slots.release()
+                continue
+            self.metrics.count('batches')
+            self.metrics.count('batched', len(batch))
+            # as a time.time() for the worker, when the last one runs out
+            deadline = time.time() + max(
+                request.start for request in batch) + self.timeout - \
+                default_timer()
+            self.pool.apply_async(
+                answer_chunk, ([request.table for request in batch],
+                               self.engine, deadline),
+                callback=lambda answers, batch=batch: self.finish(
+                    batch, answers))
+
+    def finish(self, batch, answers):
+        self.slots.release()
+        for request, answer in zip(batch, answers):
+            request.finish(answer)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.pool.terminate()
+
+
+class SolveHandler(SocketServer.StreamRequestHandler):
+    """
+    One connection. This thread reads and queues the puzzles, a second one
+    writes the answers back in order as they come, so a client can send
+    many puzzles before it reads any answer and they can share batches.
+    """
+
+    def handle(self):
+        dispatcher = self.server.dispatcher
+        pending = Queue.Queue()
+        writer = threading.Thread(target=self.write, args=(pending,))
+        writer.start()
+        try:
+            # readline, the file iterator would wait for a whole buffer
+            for line in iter(self.rfile.readline, ''):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line == 'stats':
+                    pending.put(json.dumps(dispatcher.metrics.report(),
+                                           sort_keys=True))
+                else:
+                    pending.put(dispatcher.submit(line))
+        finally:
+            pending.put(None)
+            writer.join()
+
+    def write(self, pending):
+        dispatcher = self.server.dispatcher
+        while True:
+            request = pending.get()
+            if request is None:
+                return
+            if isinstance(request, Request):
+                request = dispatcher.wait(request)
+            try:
+                self.wfile.write(request + '\n')
+                self.wfile.flush()
+            except socket.error:
+                # the client went away, drain what is left unanswered
+                continue
+
+
+class SolveServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class UnixSolveServer(SocketServer.ThreadingMixIn,
+                      SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(dispatcher, path=None, port=None):
+    """
+    A server for the dispatcher on the Unix socket at path, or else on
+    localhost:port.
+    """
+    if path is not None:
+        if os.path.exists(path):
+            os.remove(path)
+        server = UnixSolveServer(path, SolveHandler)
+    else:
+        server = SolveServer(('127.0.0.1', port), SolveHandler)
+    server.dispatcher = dispatcher
+    return server
+
+
+def connect(path=None, port=None):
+    if path is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+    else:
+        sock = socket.create_connection(('127.0.0.1', port))
+    return sock
+
+
+def query(lines, path=None, port=None):
+    """
+    Send lines (puzzles, or 'stats') to a running service, yielding the
+    answers in order. Everything is sent from a thread of its own, so the
+    answers can be read while it goes.
+    """
+    sock = connect(path, port)
+
+    def send():
+        try:
+            for line in lines:
+                sock.sendall(line.strip() + '\n')
+        finally:
+            sock.shutdown(socket.SHUT_WR)
+    sender = threading.Thread(target=send)
+    sender.daemon = True
+    sender.start()
+    try:
+        for line in iter(sock.makefile('r').readline, ''):
+            yield line.rstrip('\n')
+    finally:
+        sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    where = parser.add_mutually_exclusive_group()
+    where.add_argument('-u', '--socket', help='Unix socket path')
+    where.add_argument('-p', '--port', type=int, default=8089,
+                       help='localhost port, without --socket')
+    commands = parser.add_subparsers(dest='command')
+    serve = commands.add_parser('serve', help='run the service')
+    serve.add_argument('-w', '--workers', type=int, default=None,
+                       help='worker processes (default: one per CPU)')
+    serve.add_argument('-b', '--batch-size', type=int, default=32)
+    serve.add_argument('--batch-wait', type=float, default=0.002,
+                       help='seconds a batch waits to fill up')
+    serve.add_argument('--max-pending', type=int, default=1024,
+                       help='queued puzzles before clients are held up')
+    serve.add_argument('-t', '--timeout', type=float, default=10.0,
+                       help='seconds a puzzle may take, queueing included')
+    serve.add_argument('-e', '--engine', choices=['table', 'batch', 'dlx'],
+                       default='table')
+    query_parser = commands.add_parser(
+        'query', help='send puzzles, one per line, and print the answers')
+    query_parser.add_argument(
+        'puzzles', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
+        help='file to read the puzzles from (default: stdin)')
+    commands.add_parser('stats', help="print the service's stats")
+    args = parser.parse_args(argv)
+
+    if args.command == 'query':
+        lines = (line for line in args.puzzles if line.strip())
+        for answer in query(lines, args.socket, args.port):
+            sys.stdout.write(answer + '\n')
+        return 0
+    if args.command == 'stats':
+        for answer in query(['stats'], args.socket, args.port):
+            sys.stdout.write(answer + '\n')
+        return 0
+
+    dispatcher = Dispatcher(args.workers, args.batch_size, args.batch_wait,
+                            args.max_pending, args.timeout, args.engine)
+    server = make_server(dispatcher, args.socket, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        dispatcher.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())